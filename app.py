@@ -1,8 +1,10 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 import os
 import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-import requests
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,8 +14,18 @@ load_dotenv()
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '')))
 
 # Import your core analysis function from cyber_agent_core.py
-# This will also initialize the LLM (gemini-1.5-flash) when app.py starts
-from cyber_agent_core import analyze_threat_intelligence
+# The LLM (gemini-1.5-flash) is initialized lazily on the first analysis, not at startup
+_core_import_started = time.perf_counter()
+from cyber_agent_core import analyze_threat_report, stream_threat_intelligence, report_cache
+from triage import get_triage_stats
+from history_store import parse_history_time
+from metrics import ERRORS, REQUEST_SECONDS, render_metrics
+from log_analysis import analyze_log_stream
+from web_common import (
+    LOG_MAX_UPLOAD_BYTES, MAX_INPUT_CHARS, MAX_LOG_INPUT_CHARS, build_analysis_result, chatbot_reply,
+    history_query_from_args, history_store, sse_event,
+)
+print(f"Loaded analysis core in {(time.perf_counter() - _core_import_started) * 1000:.0f} ms")
 
 app = Flask(__name__)
 
@@ -25,34 +37,45 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'fallback_secret_key')
 app.config['DEBUG'] = True
 app.config['USE_RELOADER'] = False # Prevents file locking issues on Windows
 
-analysis_history = []
+# --- Batch analysis settings ---
+# The pool is shared by all batch requests, so the number of concurrent Gemini
+# calls stays bounded no matter how many batches are in flight.
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 8))
+BATCH_ITEM_TIMEOUT = float(os.getenv('BATCH_ITEM_TIMEOUT', 60))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch-analysis')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """Observes request latency per endpoint. Streamed responses are measured until their headers are sent."""
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method, str(response.status_code))
+    return response
 
 @app.route('/')
 def index():
     """Renders the main page for threat analysis input."""
     return render_template('index.html')
 
-def extract_severity_from_report(report):
-    """Extracts the severity level from the AI report text (High, Medium, etc)."""
-    import re
-    match = re.search(r"Severity Assessment:\s*(?:`)?(Informational|Low|Medium|High|Critical)(?:`)?", report, re.IGNORECASE)
-    if match:
-        return match.group(1).capitalize()
-    # Fallback: try to find severity in the text
-    for sev in ["Critical", "High", "Medium", "Low", "Informational"]:
-        if sev.lower() in report.lower():
-            return sev
-    return "Unknown"
+def run_analysis(input_text):
+    """Runs the AI agent on one input and returns its report with severity and mitigation."""
+    return build_analysis_result(input_text, analyze_threat_report(input_text))
 
 @app.route('/analyze_threat', methods=['POST'])
 def analyze_threat():
     """Receives threat text, calls AI agent, and returns analysis report and mitigation."""
     data = request.get_json()
     input_text = data.get('text', '').strip()
+    max_chars = MAX_LOG_INPUT_CHARS if data.get('mode') == 'log' else MAX_INPUT_CHARS
 
     # Limit input length for safety
-    if len(input_text) > 5000:
-        return jsonify({'success': False, 'message': 'Input too long. Please limit to 5000 characters.'}), 400
+    if len(input_text) > max_chars:
+        return jsonify({'success': False, 'message': f'Input too long. Please limit to {max_chars} characters.'}), 400
 
     if not input_text:
         return jsonify({'success': False, 'message': 'No input text provided for analysis.'}), 400
@@ -61,46 +84,240 @@ def analyze_threat():
     print(input_text[:200] + "..." if len(input_text) > 200 else input_text)
 
     try:
-        report = analyze_threat_intelligence(input_text)
-        severity = extract_severity_from_report(report)
-        # Simple mitigation suggestion logic (replace with your own or use LLM)
-        mitigation = []
-        if "phishing" in report.lower():
-            mitigation.append("Warn users not to click suspicious links or provide credentials.")
-        if "malware" in report.lower():
-            mitigation.append("Run a full antivirus scan and isolate affected systems.")
-        if "ransomware" in report.lower():
-            mitigation.append("Disconnect infected machines and restore from backups.")
-        if not mitigation:
-            mitigation.append("No specific mitigation required. Monitor for unusual activity.")
-
-        analysis_history.append({
-            'input': input_text,
-            'report': report,
-            'mitigation': mitigation,
-            'severity': severity
-        })
+        result = run_analysis(input_text)
+        history_store.add(result)
 
         print("\n--- Web App: Analysis complete. Returning report and mitigation. ---")
-        return jsonify({'success': True, 'report': report, 'mitigation': mitigation, 'severity': severity})
+        return jsonify({'success': True, 'report': result['report'], 'mitigation': result['mitigation'],
+                        'severity': result['severity'], 'threat_type': result['threat_type'], 'analysis': result['analysis']})
     except Exception as e:
         print(f"ERROR: Analysis failed in Flask route: {e}")
+        ERRORS.inc('analyze_threat')
         # User-friendly error for Gemini API issues
         if 'gemini' in str(e).lower() or 'api' in str(e).lower():
             return jsonify({'success': False, 'message': 'AI service unavailable. Please try again later.'}), 503
         return jsonify({'success': False, 'message': f'Analysis failed due to an internal error: {e}'}), 500
 
+@app.route('/analyze_threat_stream', methods=['POST'])
+def analyze_threat_stream():
+    """
+    Streaming version of /analyze_threat over Server-Sent Events. Emits 'iocs' and 'lookups'
+    as soon as the tools finish, 'token' events as the report is generated, 'analysis' with
+    the structured report, then a final 'done' event with severity and mitigation (or 'error').
+    """
+    data = request.get_json(silent=True) or {}
+    input_text = data.get('text', '').strip()
+    max_chars = MAX_LOG_INPUT_CHARS if data.get('mode') == 'log' else MAX_INPUT_CHARS
+
+    if len(input_text) > max_chars:
+        return jsonify({'success': False, 'message': f'Input too long. Please limit to {max_chars} characters.'}), 400
+    if not input_text:
+        return jsonify({'success': False, 'message': 'No input text provided for analysis.'}), 400
+
+    print(f"\n--- Web App: Streaming analysis of input text (length: {len(input_text)}) ---")
+
+    def generate():
+        report_parts = []
+        analysis = None
+        try:
+            for event, payload in stream_threat_intelligence(input_text):
+                if event == 'token':
+                    report_parts.append(payload)
+                elif event == 'analysis':
+                    analysis = payload
+                yield sse_event(event, payload)
+            result = build_analysis_result(input_text, analysis, "".join(report_parts))
+            history_store.add(result)
+            yield sse_event('done', {'success': True, 'severity': result['severity'],
+                                      'threat_type': result['threat_type'], 'mitigation': result['mitigation']})
+            print("\n--- Web App: Streaming analysis complete. ---")
+        except Exception as e:
+            print(f"ERROR: Streaming analysis failed in Flask route: {e}")
+            ERRORS.inc('analyze_threat_stream')
+            yield sse_event('error', {'success': False, 'message': f'Analysis failed due to an internal error: {e}'})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+def _run_batch_item(index, input_text, started):
+    """Worker body for one batch item. Records its start time so the item timeout excludes queueing."""
+    started[index] = time.monotonic()
+    return run_analysis(input_text)
+
+def _batch_line(payload):
+    return json.dumps(payload) + "\n"
+
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyzes many alert texts in one request on the shared batch worker pool.
+    Results are streamed back as newline-delimited JSON, one line per item, either
+    as each item finishes (default) or in input order when 'ordered' is true.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': "Send a JSON object with a 'texts' list for batch analysis."}), 400
+    texts = data.get('texts')
+    ordered = bool(data.get('ordered', False))
+
+    # Clients may shorten the per-item timeout, never extend it beyond BATCH_ITEM_TIMEOUT
+    try:
+        item_timeout = float(data.get('timeout', BATCH_ITEM_TIMEOUT))
+    except (TypeError, ValueError):
+        item_timeout = None
+    if item_timeout is None or not item_timeout > 0:
+        return jsonify({'success': False, 'message': "'timeout' must be a positive number of seconds."}), 400
+    item_timeout = min(item_timeout, BATCH_ITEM_TIMEOUT)
+
+    if not isinstance(texts, list) or not texts:
+        return jsonify({'success': False, 'message': "Provide a non-empty 'texts' list for batch analysis."}), 400
+    if len(texts) > BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'Batch too large. Please limit to {BATCH_MAX_ITEMS} items.'}), 400
+
+    # Validate every item up front so a bad item is reported without being sent to the LLM
+    items = []
+    rejected = {}
+    for index, text in enumerate(texts):
+        text = text.strip() if isinstance(text, str) else ''
+        if not text:
+            rejected[index] = 'No input text provided for analysis.'
+        elif len(text) > MAX_INPUT_CHARS:
+            rejected[index] = f'Input too long. Please limit to {MAX_INPUT_CHARS} characters.'
+        else:
+            items.append((index, text))
+
+    print(f"\n--- Web App: Batch analysis of {len(texts)} items ({len(rejected)} rejected, ordered={ordered}) ---")
+
+    def generate():
+        # Items are submitted once the response starts, and the finally below cancels whatever
+        # is still queued when the client disconnects, so an abandoned batch does not hold the pool
+        started = {}
+        futures = {batch_executor.submit(_run_batch_item, index, text, started): index for index, text in items}
+        results = {index: {'index': index, 'success': False, 'message': message} for index, message in rejected.items()}
+        next_index = 0
+        pending = set(futures)
+
+        def flush():
+            # In unordered mode emit everything collected so far; in ordered mode only the ready prefix
+            nonlocal next_index
+            if not ordered:
+                for index in list(results):
+                    yield _batch_line(results.pop(index))
+                return
+            while next_index in results:
+                yield _batch_line(results.pop(next_index))
+                next_index += 1
+
+        try:
+            yield from flush()
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                        history_store.add(result)
+                        results[index] = {'index': index, 'success': True, **result}
+                    except Exception as e:
+                        print(f"ERROR: Batch item {index} failed: {e}")
+                        ERRORS.inc('analyze_batch')
+                        results[index] = {'index': index, 'success': False, 'message': f'Analysis failed: {e}'}
+                # A blocked LLM call cannot be interrupted, but we stop waiting for it
+                now = time.monotonic()
+                for future in list(pending):
+                    index = futures[future]
+                    if index in started and now - started[index] > item_timeout:
+                        pending.discard(future)
+                        future.cancel()
+                        ERRORS.inc('analyze_batch_timeout')
+                        results[index] = {'index': index, 'success': False, 'message': f'Analysis timed out after {item_timeout:g} seconds.'}
+                yield from flush()
+            print(f"--- Web App: Batch analysis of {len(texts)} items complete. ---")
+        finally:
+            cancelled = sum(future.cancel() for future in futures)
+            if cancelled:
+                print(f"--- Web App: Batch response closed early; cancelled {cancelled} queued items. ---")
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/analyze_log', methods=['POST'])
+def analyze_log():
+    """
+    Analyzes a large log file, uploaded as multipart field 'file' or sent as the raw request
+    body. The log is read incrementally, analyzed in parallel chunks and merged into one report.
+    """
+    if request.content_length and request.content_length > LOG_MAX_UPLOAD_BYTES:
+        return jsonify({'success': False, 'message': f'Log file too large. Please limit to {LOG_MAX_UPLOAD_BYTES} bytes.'}), 413
+    upload = request.files.get('file')
+    if upload is None and request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        return jsonify({'success': False, 'message': "Provide the log as a 'file' upload or as the request body."}), 400
+    stream = upload.stream if upload is not None else request.stream
+    name = (upload.filename if upload is not None else '') or 'request body'
+
+    print(f"\n--- Web App: Chunked analysis of log '{name}' ---")
+    try:
+        analysis = analyze_log_stream(stream)
+    except Exception as e:
+        print(f"ERROR: Log analysis failed in Flask route: {e}")
+        ERRORS.inc('analyze_log')
+        return jsonify({'success': False, 'message': f'Log analysis failed due to an internal error: {e}'}), 500
+    if not analysis.chunks:
+        return jsonify({'success': False, 'message': 'The log file is empty.'}), 400
+
+    # History stores a short description; the flagged IoCs are indexed from the structured report
+    description = f"[Log file] {name}: {analysis.lines} lines in {analysis.chunks} chunks"
+    result = build_analysis_result(description, analysis.to_report())
+    history_store.add(result)
+    print(f"--- Web App: Log analysis of '{name}' complete ({analysis.chunks} chunks). ---")
+    return jsonify({'success': True, 'report': result['report'], 'mitigation': result['mitigation'],
+                    'severity': result['severity'], 'threat_type': result['threat_type'],
+                    'analysis': result['analysis'], 'stats': analysis.stats()})
+
 @app.route('/history')
 def history():
-    return jsonify({'success': True, 'history': analysis_history})
+    """
+    Returns one page of analysis history, newest first. Supports 'limit', 'cursor' (the
+    'next_cursor' of the previous page) and filters 'severity', 'threat_type', 'ioc',
+    'verdict' (of that IoC, or of any IoC), 'since' and 'until'.
+    """
+    try:
+        query = history_query_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid history query: {e}'}), 400
+    items, next_cursor = history_store.query(**query)
+    return jsonify({'success': True, 'history': items, 'next_cursor': next_cursor})
+
+@app.route('/history/stats')
+def history_stats():
+    """Aggregates history between 'since' and 'until': counts by severity, threat type and day, and the top flagged IoCs."""
+    try:
+        since = parse_history_time(request.args.get('since'))
+        until = parse_history_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid history query: {e}'}), 400
+    return jsonify({'success': True, 'stats': history_store.stats(since=since, until=until)})
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     """Clears the analysis history."""
-    global analysis_history
-    analysis_history = []
+    history_store.clear()
     return jsonify({'success': True})
 
+@app.route('/cache_stats')
+def cache_stats():
+    """Returns hit/miss counters for the report cache."""
+    return jsonify({'success': True, 'report_cache': report_cache.stats()})
+
+@app.route('/triage_stats')
+def triage_stats():
+    """Returns local triage decision counts, including how many LLM calls were avoided."""
+    return jsonify({'success': True, 'triage': get_triage_stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage and request latency histograms, LLM tokens, cache ratios and errors."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/chatbot', methods=['POST'])
 def chatbot():
     data = request.get_json()
@@ -108,31 +325,7 @@ def chatbot():
     if not user_message:
         return jsonify({'success': False, 'message': 'No message provided.'}), 400
     try:
-        # Simple keyword-based responses
-        if "ai" in user_message or "artificial intelligence" in user_message:
-            answer = "AI (Artificial Intelligence) refers to computer systems that can perform tasks that typically require human intelligence, such as learning, reasoning, and problem-solving."
-        elif "risk" in user_message:
-            answer = "A risk is the potential for loss or damage when a threat exploits a vulnerability."
-        elif "threat" in user_message:
-            answer = "A threat is any circumstance or event with the potential to adversely impact organizational operations, assets, or individuals."
-        elif "phishing" in user_message:
-            answer = "Phishing is a cyber attack where attackers impersonate legitimate organizations via email, text, or other means to steal sensitive information."
-        elif "malware" in user_message:
-            answer = "Malware is malicious software designed to disrupt, damage, or gain unauthorized access to computer systems."
-        elif "ransomware" in user_message:
-            answer = "Ransomware is a type of malware that encrypts your files and demands payment for the decryption key."
-        elif "mitigation" in user_message or "prevent" in user_message:
-            answer = "Mitigation steps include keeping software updated, using strong passwords, enabling multi-factor authentication, and educating users about threats."
-        elif "history" in user_message:
-            answer = "You can view your analysis history by clicking the 'View Analysis History' button below the main panel."
-        elif "how to use" in user_message or "help" in user_message:
-            answer = "Paste suspicious text (like emails, logs, or URLs) in the input box and click 'Analyze Threat' to get an AI-powered analysis."
-        elif "cybersecurity" in user_message:
-            answer = "Cybersecurity is the practice of protecting systems, networks, and programs from digital attacks."
-        elif "ioc" in user_message or "indicator of compromise" in user_message:
-            answer = "An Indicator of Compromise (IOC) is evidence that a system has been breached, such as unusual network traffic, file changes, or log entries."
-        else:
-            answer = "I'm your CyberGuard Assistant. Ask me about AI, threats, phishing, malware, risk, mitigation, or how to use this tool!"
+        answer = chatbot_reply(user_message)
         return jsonify({'success': True, 'response': answer})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
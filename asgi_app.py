@@ -0,0 +1,282 @@
+"""
+Async (ASGI) serving mode for CyberGuard AI Analyst.
+
+Serves the same routes as app.py, except batch analysis, with Quart, Flask's async twin.
+Analyses await the non-blocking Gemini client instead of pinning a worker thread, so one
+process can keep hundreds of analyses in flight. Streamed analyses and log uploads run their
+blocking steps in worker threads. Admission is bounded: at most ASGI_MAX_IN_FLIGHT
+analyses run at once, up to ASGI_MAX_QUEUED more wait for a slot, and anything beyond
+that is rejected with 429 and a Retry-After header.
+
+Run with:  hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file before the settings below are read
+load_dotenv()
+
+from quart import Quart, Response, g, render_template, request, jsonify
+
+from cyber_agent_core import analyze_threat_report_async, report_cache, stream_threat_intelligence
+from triage import get_triage_stats
+from metrics import ERRORS, REQUEST_SECONDS, render_metrics
+from history_store import parse_history_time
+from log_analysis import analyze_log_stream
+# Severity/mitigation post-processing, history storage and chatbot answers are shared with the Flask app
+from web_common import (
+    LOG_MAX_UPLOAD_BYTES, MAX_INPUT_CHARS, MAX_LOG_INPUT_CHARS, build_analysis_result, chatbot_reply,
+    history_query_from_args, history_store, sse_event,
+)
+
+ASGI_MAX_IN_FLIGHT = int(os.getenv('ASGI_MAX_IN_FLIGHT', 200))
+ASGI_MAX_QUEUED = int(os.getenv('ASGI_MAX_QUEUED', 500))
+ASGI_RETRY_AFTER = int(os.getenv('ASGI_RETRY_AFTER', 5))
+
+app = Quart(__name__)
+app.secret_key = os.getenv('FLASK_SECRET_KEY', 'fallback_secret_key')
+# Log uploads are spooled to disk while they arrive, so they may be as large as the Flask app allows
+app.config['MAX_CONTENT_LENGTH'] = LOG_MAX_UPLOAD_BYTES
+app.config['BODY_TIMEOUT'] = None
+
+
+class AdmissionLimiter:
+    """
+    Bounded admission for analyses: a semaphore of running slots plus a cap on waiters.
+    Only touched from the event loop thread, so the counter needs no lock.
+    """
+
+    def __init__(self, max_in_flight, max_queued):
+        self.capacity = max_in_flight + max_queued
+        self.admitted = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    def try_admit(self):
+        if self.admitted >= self.capacity:
+            return False
+        self.admitted += 1
+        return True
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Holds a running slot for an admitted request and releases its admission on exit."""
+        try:
+            async with self._slots:
+                yield
+        finally:
+            self.admitted -= 1
+
+    async def run(self, coro):
+        """Runs an admitted coroutine once a slot is free."""
+        async with self.slot():
+            return await coro
+
+
+limiter = AdmissionLimiter(ASGI_MAX_IN_FLIGHT, ASGI_MAX_QUEUED)
+
+
+def _busy_response():
+    ERRORS.inc('admission_rejected')
+    return jsonify({'success': False, 'message': 'Server is busy. Please retry shortly.'}), 429, {'Retry-After': str(ASGI_RETRY_AFTER)}
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_duration(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method, str(response.status_code))
+    return response
+
+
+@app.route('/')
+async def index():
+    """Renders the main page for threat analysis input."""
+    return await render_template('index.html')
+
+
+@app.route('/analyze_threat', methods=['POST'])
+async def analyze_threat():
+    """Receives threat text, awaits the AI agent, and returns analysis report and mitigation."""
+    data = await request.get_json()
+    input_text = data.get('text', '').strip()
+    max_chars = MAX_LOG_INPUT_CHARS if data.get('mode') == 'log' else MAX_INPUT_CHARS
+
+    if len(input_text) > max_chars:
+        return jsonify({'success': False, 'message': f'Input too long. Please limit to {max_chars} characters.'}), 400
+    if not input_text:
+        return jsonify({'success': False, 'message': 'No input text provided for analysis.'}), 400
+
+    if not limiter.try_admit():
+        return _busy_response()
+
+    try:
+        analysis = await limiter.run(analyze_threat_report_async(input_text))
+        result = build_analysis_result(input_text, analysis)
+        await asyncio.to_thread(history_store.add, result)
+        return jsonify({'success': True, 'report': result['report'], 'mitigation': result['mitigation'],
+                        'severity': result['severity'], 'threat_type': result['threat_type'], 'analysis': result['analysis']})
+    except Exception as e:
+        print(f"ERROR: Analysis failed in ASGI route: {e}")
+        ERRORS.inc('analyze_threat')
+        if 'gemini' in str(e).lower() or 'api' in str(e).lower():
+            return jsonify({'success': False, 'message': 'AI service unavailable. Please try again later.'}), 503
+        return jsonify({'success': False, 'message': f'Analysis failed due to an internal error: {e}'}), 500
+
+
+@app.route('/analyze_threat_stream', methods=['POST'])
+async def analyze_threat_stream():
+    """
+    Streaming analysis over Server-Sent Events; same events as the Flask app. The pipeline
+    is a blocking generator, so each step is pulled in a worker thread.
+    """
+    data = await request.get_json(silent=True) or {}
+    input_text = data.get('text', '').strip()
+    max_chars = MAX_LOG_INPUT_CHARS if data.get('mode') == 'log' else MAX_INPUT_CHARS
+
+    if len(input_text) > max_chars:
+        return jsonify({'success': False, 'message': f'Input too long. Please limit to {max_chars} characters.'}), 400
+    if not input_text:
+        return jsonify({'success': False, 'message': 'No input text provided for analysis.'}), 400
+    if not limiter.try_admit():
+        return _busy_response()
+
+    async def generate():
+        async with limiter.slot():
+            events = stream_threat_intelligence(input_text)
+            report_parts = []
+            analysis = None
+            try:
+                while (item := await asyncio.to_thread(next, events, None)) is not None:
+                    event, payload = item
+                    if event == 'token':
+                        report_parts.append(payload)
+                    elif event == 'analysis':
+                        analysis = payload
+                    yield sse_event(event, payload)
+                result = build_analysis_result(input_text, analysis, "".join(report_parts))
+                await asyncio.to_thread(history_store.add, result)
+                yield sse_event('done', {'success': True, 'severity': result['severity'],
+                                         'threat_type': result['threat_type'], 'mitigation': result['mitigation']})
+            except Exception as e:
+                print(f"ERROR: Streaming analysis failed in ASGI route: {e}")
+                ERRORS.inc('analyze_threat_stream')
+                yield sse_event('error', {'success': False, 'message': f'Analysis failed due to an internal error: {e}'})
+
+    response = Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+
+async def _spool_request_body():
+    """Copies the raw request body to a temporary file as it arrives, without holding it in memory."""
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    async for data in request.body:
+        spool.write(data)
+    spool.seek(0)
+    return spool
+
+
+@app.route('/analyze_log', methods=['POST'])
+async def analyze_log():
+    """Chunked analysis of a log file uploaded as multipart field 'file' or as the raw body; same as the Flask app."""
+    if request.content_length and request.content_length > LOG_MAX_UPLOAD_BYTES:
+        return jsonify({'success': False, 'message': f'Log file too large. Please limit to {LOG_MAX_UPLOAD_BYTES} bytes.'}), 413
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        upload = (await request.files).get('file')
+        if upload is None:
+            return jsonify({'success': False, 'message': "Provide the log as a 'file' upload or as the request body."}), 400
+        stream, name = upload.stream, upload.filename or 'request body'
+    else:
+        stream, name = await _spool_request_body(), 'request body'
+    if not limiter.try_admit():
+        stream.close()
+        return _busy_response()
+
+    print(f"\n--- Web App: Chunked analysis of log '{name}' ---")
+    try:
+        with stream:
+            analysis = await limiter.run(asyncio.to_thread(analyze_log_stream, stream))
+    except Exception as e:
+        print(f"ERROR: Log analysis failed in ASGI route: {e}")
+        ERRORS.inc('analyze_log')
+        return jsonify({'success': False, 'message': f'Log analysis failed due to an internal error: {e}'}), 500
+    if not analysis.chunks:
+        return jsonify({'success': False, 'message': 'The log file is empty.'}), 400
+
+    description = f"[Log file] {name}: {analysis.lines} lines in {analysis.chunks} chunks"
+    result = build_analysis_result(description, analysis.to_report())
+    await asyncio.to_thread(history_store.add, result)
+    return jsonify({'success': True, 'report': result['report'], 'mitigation': result['mitigation'],
+                    'severity': result['severity'], 'threat_type': result['threat_type'],
+                    'analysis': result['analysis'], 'stats': analysis.stats()})
+
+
+@app.route('/history')
+async def history():
+    """Returns one page of analysis history; same query arguments as the Flask app."""
+    try:
+        query = history_query_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid history query: {e}'}), 400
+    items, next_cursor = await asyncio.to_thread(history_store.query, **query)
+    return jsonify({'success': True, 'history': items, 'next_cursor': next_cursor})
+
+
+@app.route('/history/stats')
+async def history_stats():
+    """Aggregates analysis history; same query arguments as the Flask app."""
+    try:
+        since = parse_history_time(request.args.get('since'))
+        until = parse_history_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid history query: {e}'}), 400
+    stats = await asyncio.to_thread(history_store.stats, since=since, until=until)
+    return jsonify({'success': True, 'stats': stats})
+
+
+@app.route('/clear_history', methods=['POST'])
+async def clear_history():
+    """Clears the analysis history."""
+    await asyncio.to_thread(history_store.clear)
+    return jsonify({'success': True})
+
+
+@app.route('/cache_stats')
+async def cache_stats():
+    """Returns hit/miss counters for the report cache."""
+    return jsonify({'success': True, 'report_cache': report_cache.stats()})
+
+
+@app.route('/triage_stats')
+async def triage_stats():
+    """Returns local triage decision counts, including how many LLM calls were avoided."""
+    return jsonify({'success': True, 'triage': get_triage_stats()})
+
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus scrape endpoint; same series as the Flask app."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/chatbot', methods=['POST'])
+async def chatbot():
+    data = await request.get_json()
+    user_message = data.get('message', '').strip().lower()
+    if not user_message:
+        return jsonify({'success': False, 'message': 'No message provided.'}), 400
+    return jsonify({'success': True, 'response': chatbot_reply(user_message)})
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,217 @@
+"""
+Offline benchmark and regression harness for the analysis pipeline.
+
+Runs each pipeline stage against synthetic log corpora of increasing size, with the LLM
+replaced by the deterministic fake backend (or replayed recordings), and reports
+throughput, p50/p99 latency and peak traced memory per stage as JSON.
+
+Stages:
+  extract   - extract_iocs_from_text
+  lookup    - threat intel resolution of the extracted IoCs (verdict cache cleared per run)
+  parse     - parse_report on a text-layout report of the corpus size
+  pipeline  - analyze_threat_report end to end (report cache cleared per run). Local triage
+              is switched off so every run builds the prompt and calls the LLM backend;
+              each result records the answer sources seen, so a short-circuit shows up.
+
+Examples:
+  python benchmark_pipeline.py --sizes 1KB,1MB,50MB --output bench.json
+  python benchmark_pipeline.py --baseline bench.json --tolerance 0.25
+The second form exits with status 1 when any p50 latency regresses by more than the tolerance.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Keep the benchmark offline
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+import cyber_agent_core as core
+from ioc_extractor import extract_iocs_from_text
+from llm_backend import FakeBackend, RecordedBackend, set_llm_backend
+from report_schema import parse_report
+
+STAGES = ("extract", "lookup", "parse", "pipeline")
+_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+_LOG_TEMPLATES = (
+    "{ts} INFO sshd[{pid}]: Accepted publickey for {user} from {ip} port {port}",
+    "{ts} WARN sshd[{pid}]: Failed password for invalid user {user} from {ip} port {port}",
+    "{ts} INFO proxy: {user} GET {url} 200 {port}",
+    "{ts} ALERT mail-gw: message from {email} to {user}@corp.example.com quarantined, attachment {file}",
+    "{ts} INFO edr: process hash {hash} started by {user}",
+    "{ts} INFO backup: nightly job completed successfully in {port} seconds",
+    "{ts} NOTICE vuln-scan: host {ip} affected by {cve}",
+)
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit, factor in _UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def synthetic_corpus(size, seed=1337):
+    """Deterministic log-like text of about `size` characters with a realistic IoC mix."""
+    rng = random.Random(seed)
+    ips = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}" for _ in range(2000)]
+    ips += ["185.123.45.67", "10.0.0.5", "192.168.1.20"]
+    hosts = [f"{word}{rng.randint(1, 99)}.{tld}" for word in ("cdn", "login-update", "portal", "files", "phish-kit") for tld in ("com", "net", "io", "ru")]
+    users = ["admin", "jsmith", "svc_backup", "priya", "root", "guest"]
+    lines = []
+    length = 0
+    while length < size:
+        line = rng.choice(_LOG_TEMPLATES).format(
+            ts=f"2025-05-27 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            pid=rng.randint(100, 65000),
+            user=rng.choice(users),
+            ip=rng.choice(ips),
+            port=rng.randint(1, 65535),
+            url=f"https://{rng.choice(hosts)}/path/{rng.randint(1, 500)}",
+            email=f"{rng.choice(users)}@{rng.choice(hosts)}",
+            file=rng.choice(("invoice.pdf.exe", "report.xlsx", "scan.jpg.scr", "notes.txt")),
+            hash="%032x" % rng.getrandbits(128),
+            cve=f"CVE-{rng.randint(2015, 2025)}-{rng.randint(1000, 49999)}",
+        )
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def stage_runner(stage, corpus):
+    """Returns a zero-argument callable running one iteration of the stage on the corpus."""
+    if stage == "extract":
+        return lambda: extract_iocs_from_text(corpus)
+    if stage == "lookup":
+        iocs = extract_iocs_from_text(corpus)
+
+        def lookup():
+            core.threat_intel.cache.clear()
+            core.threat_intel.resolve(iocs)
+        return lookup
+    if stage == "parse":
+        # The corpus as the findings section, so the single pass covers the whole report
+        report = f"1. Threat Summary: Suspicious Activity\n2. Identified IoCs & Findings:\n{corpus}\n3. Severity Assessment: Medium\n"
+        return lambda: parse_report(report)
+    if stage == "pipeline":
+        def pipeline():
+            core.report_cache.clear()
+            triage_enabled, core.TRIAGE_ENABLED = core.TRIAGE_ENABLED, False
+            try:
+                pipeline.sources.add(core.analyze_threat_report(corpus)["source"])
+            finally:
+                core.TRIAGE_ENABLED = triage_enabled
+        pipeline.sources = set()
+        return pipeline
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def measure(run, size, repeat, min_seconds):
+    """Times the callable, then measures its peak traced memory in one extra run."""
+    run()  # warm-up
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat or (time.perf_counter() - started < min_seconds and len(timings) < 1000):
+        t0 = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    mean = sum(timings) / len(timings)
+    return {
+        "iterations": len(timings),
+        "throughput_mb_s": round(size / (1024 ** 2) / mean, 3) if mean else None,
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "peak_memory_mb": round(peak / (1024 ** 2), 3),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of p50 regressions beyond the tolerance relative to a previous run."""
+    previous = {(r["stage"], r["size_bytes"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["stage"], result["size_bytes"]))
+        if old and old["p50_ms"] > 0 and result["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append({
+                "stage": result["stage"],
+                "size_bytes": result["size_bytes"],
+                "baseline_p50_ms": old["p50_ms"],
+                "p50_ms": result["p50_ms"],
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1KB,64KB,1MB,10MB,50MB", help="comma-separated corpus sizes")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--repeat", type=int, default=5, help="minimum timed iterations per stage and size")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="keep iterating small inputs for at least this long")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated fake LLM latency in seconds")
+    parser.add_argument("--recordings", help="replay LLM reports from this JSONL file instead of the fake backend")
+    parser.add_argument("--seed", type=int, default=1337)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON results to compare p50 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown versus the baseline")
+    args = parser.parse_args(argv)
+
+    set_llm_backend(RecordedBackend(args.recordings) if args.recordings else FakeBackend(latency=args.llm_latency))
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+
+    results = []
+    # The pipeline logs prompts and token usage with print(); keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        for size in sizes:
+            corpus = synthetic_corpus(size, seed=args.seed)
+            for stage in stages:
+                print(f"benchmark: {stage} @ {size} bytes")
+                result = {"stage": stage, "size_bytes": size}
+                run = stage_runner(stage, corpus)
+                result.update(measure(run, size, args.repeat, args.min_seconds))
+                if hasattr(run, "sources"):
+                    result["sources"] = sorted(run.sources)
+                results.append(result)
+
+    report = {
+        "python": sys.version.split()[0],
+        "llm_backend": "recorded" if args.recordings else "fake",
+        "llm_latency_s": args.llm_latency,
+        "results": results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(results, json.load(f), args.tolerance)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
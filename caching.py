@@ -0,0 +1,164 @@
+"""
+Caches for the analysis pipeline.
+
+TTLCache is a thread-safe, size-bounded LRU with a per-entry time-to-live.
+ReportCache puts a TTLCache in front of the LLM call, keyed by a content hash of the
+normalized input text and tool output, with an optional SQLite tier that survives restarts.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Size-bounded LRU cache where every entry also expires after its TTL (in seconds)."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ReportCache:
+    """
+    Content-addressed cache for generated threat reports.
+    Lookups go to the in-memory LRU first, then to the SQLite file when db_path is set.
+    Disk hits are promoted back into memory.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, db_path: str = None, max_disk_entries: int = 100000):
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS report_cache ("
+                " key TEXT PRIMARY KEY, report TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_report_cache_expires ON report_cache (expires_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(input_text: str, tool_output: str) -> str:
+        """Hashes the input with whitespace collapsed, so re-pasted copies of the same email share a key."""
+        normalized = " ".join(input_text.split())
+        digest = hashlib.sha256()
+        digest.update(normalized.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(tool_output.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        report = self.memory.get(key)
+        if report is None and self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT report, expires_at FROM report_cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time()),
+                ).fetchone()
+            if row:
+                report = row[0]
+                # Keep the remaining disk TTL instead of restarting it
+                self.memory.set(key, report, ttl=row[1] - time.time())
+        if report is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return report
+
+    def set(self, key: str, report: str):
+        self.memory.set(key, report)
+        if self._db is None:
+            return
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO report_cache (key, report, expires_at) VALUES (?, ?, ?)",
+                (key, report, now + self.ttl),
+            )
+            self._db.execute("DELETE FROM report_cache WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM report_cache WHERE key IN ("
+                " SELECT key FROM report_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+
+    def clear(self):
+        self.memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM report_cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "persistent": self._db is not None,
+        }
+
+
+def report_cache_from_env() -> ReportCache:
+    """Builds the report cache from REPORT_CACHE_SIZE, REPORT_CACHE_TTL and REPORT_CACHE_DB."""
+    return ReportCache(
+        max_entries=int(os.getenv("REPORT_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("REPORT_CACHE_TTL", 86400)),
+        db_path=os.getenv("REPORT_CACHE_DB") or None,
+    )
@@ -1,139 +1,268 @@
-import google.generativeai as genai
-import os
-import re # For regular expressions to extract IoCs
-import random # For simulating varying lookup results
-import requests
-from dotenv import load_dotenv
+import asyncio
+import json
+from ioc_extractor import extract_iocs_from_text, IOC_LOOKUP_TYPES
+from caching import report_cache_from_env
+from threat_intel import threat_intel_from_env, format_verdict
+from triage import TRIAGE_ENABLED, triage_input, triage_report, get_triage_stats
+from llm_backend import CircuitOpenError, LLMTimeoutError, get_llm_backend, is_transient_error
+from prompt_builder import PromptParts, build_prompt_parts
+from report_schema import (
+    REPORT_SCHEMA, ReportFormatError, check_report, parse_report, parse_report_text, parse_structured_report,
+    render_report_text, report_iocs,
+)
+from metrics import ANSWERS, ERRORS, LLM_CALLS, register_collector, timed
 
 
 # --- Configuration ---
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in .env file. Please set it up.")
-genai.configure(api_key=api_key)
+# The LLM (Gemini 1.5 Flash by default) is created lazily by llm_backend on the first
+# analysis, so importing this module needs no API key and stays fast for offline jobs.
 
-# Initialize the LLM (Gemini 1.5 Flash) for analysis
-llm_model = genai.GenerativeModel('gemini-1.5-flash')
+# Reports are cached as structured JSON by a hash of the normalized input plus tool output,
+# so repeated submissions of the same text skip the LLM call entirely
+report_cache = report_cache_from_env()
 
-# --- Simulated Agent Tools (Python Functions) ---
-
-def extract_iocs_from_text(text: str) -> dict:
-    """
-    Simulates an IoC extraction tool. Extracts URLs, IP addresses, and Email addresses.
-    This function represents a 'tool' the AI agent can conceptually 'use'.
-    """
-    iocs = {
-        "urls": [],
-        "ips": [],
-        "emails": []
-    }
-    # Regex for URLs (simplified, captures http/https links)
-    urls = re.findall(r'https?://[^\s/$.?#].[^\s]*', text)
-    for url in urls:
-        if url.endswith('.'): # Remove trailing period if it's from sentence end
-            url = url[:-1]
-        iocs["urls"].append(url)
+# Threat intel lookups for all IoCs of an input are resolved concurrently and cached per IoC
+threat_intel = threat_intel_from_env()
 
-    # Regex for IP addresses (IPv4 only, simplified)
-    ips = re.findall(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b', text)
-    iocs["ips"].extend(ips)
+def _collect_metrics():
+    """Exports cache and triage counters at scrape time; they are already counted by their owners."""
+    report = report_cache.stats()
+    verdicts = threat_intel.cache.stats()
+    triage = get_triage_stats()
+    return [
+        ("cyberguard_cache_hits_total", "counter", "Cache hits by cache.",
+         [({"cache": "report"}, report["hits"]), ({"cache": "threat_intel"}, verdicts["hits"])]),
+        ("cyberguard_cache_misses_total", "counter", "Cache misses by cache.",
+         [({"cache": "report"}, report["misses"]), ({"cache": "threat_intel"}, verdicts["misses"])]),
+        ("cyberguard_cache_hit_ratio", "gauge", "Hit ratio since start by cache.",
+         [({"cache": "report"}, report["hit_ratio"]), ({"cache": "threat_intel"}, verdicts["hit_ratio"])]),
+        ("cyberguard_cache_entries", "gauge", "Entries currently held in memory by cache.",
+         [({"cache": "report"}, report["memory"]["entries"]), ({"cache": "threat_intel"}, verdicts["entries"])]),
+        ("cyberguard_triage_decisions_total", "counter", "Local triage decisions.",
+         [({"decision": decision}, triage[decision]) for decision in ("benign", "malicious", "uncertain")]),
+    ]
 
-    # Regex for email addresses
-    emails = re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)
-    iocs["emails"].extend(emails)
+register_collector(_collect_metrics)
 
-    return iocs
+# --- Simulated Agent Tools (Python Functions) ---
 
 def simulate_threat_lookup(ioc_type: str, ioc_value: str) -> str:
     """
-    Simulates looking up an IoC's reputation (e.g., via VirusTotal, URLscan.io).
-    This is another 'tool' the AI agent uses.
-    """
-    if ioc_type == "url":
-        if "malicious" in ioc_value.lower() or "scam" in ioc_value.lower() or "phish" in ioc_value.lower():
-            return f"Simulated Threat Intel for URL '{ioc_value}': Known MALICIOUS URL, categorized as phishing/malware distribution."
-        elif "update" in ioc_value.lower() and random.random() < 0.7: # 70% chance to flag update domains as suspicious
-            return f"Simulated Threat Intel for URL '{ioc_value}': SUSPICIOUS. Domain patterns suggest potential phishing or fake updates."
-        else:
-            return f"Simulated Threat Intel for URL '{ioc_value}': No immediate threat data found in simulated database."
-    elif ioc_type == "ip":
-        if ioc_value.startswith("192.168.") or ioc_value.startswith("10.") or ioc_value.startswith("172.16."):
-            return f"Simulated Threat Intel for IP '{ioc_value}': INTERNAL/PRIVATE IP. Cannot be externally looked up."
-        elif random.random() < 0.5: # 50% chance of being flagged as malicious
-            return f"Simulated Threat Intel for IP '{ioc_value}': MALICIOUS. Associated with botnets or attack campaigns."
-        else:
-            return f"Simulated Threat Intel for IP '{ioc_value}': No threat data found in simulated database."
-    elif ioc_type == "email":
-        if "nigerianprince" in ioc_value.lower() or "urgentdelivery" in ioc_value.lower() or "amazonsupport" in ioc_value.lower():
-            return f"Simulated Threat Intel for Email '{ioc_value}': KNOWN SPAM/SCAM SENDER."
-        else:
-            return f"Simulated Threat Intel for Email '{ioc_value}': No threat data found in simulated database."
-    return f"Simulated Threat Intel for {ioc_type} '{ioc_value}': Type not recognized or no data."
+    Looks up an IoC's reputation through the threat intel layer (local stand-in for
+    VirusTotal, URLscan.io, etc.). This is another 'tool' the AI agent uses.
+    """
+    return format_verdict(threat_intel.lookup(ioc_type, ioc_value))
 
 # --- Core Agent Analysis Function (Orchestrates Tool Use and LLM Reasoning) ---
-def analyze_threat_intelligence(input_text: str) -> str:
+def run_agent_tools(input_text: str):
     """
-    Orchestrates IoC extraction (tool use) and simulated lookups (tool use),
-    then uses the LLM (brain) to provide a structured threat analysis report.
+    Runs the agent's tools on the input: IoC extraction, then threat lookups.
+    Returns (iocs, verdicts, tool_output_string) where tool_output_string is the text shown to the LLM.
     """
     # Step 1: Agent uses "extract IoCs" tool
-    iocs = extract_iocs_from_text(input_text)
+    with timed('ioc_extraction'):
+        iocs = extract_iocs_from_text(input_text)
+    # Step 2: Agent uses "threat lookup" tool for all found IoCs at once
+    with timed('threat_lookup'):
+        verdicts = threat_intel.resolve(iocs)
+    with timed('tool_output'):
+        tool_output_string = format_tool_output(iocs, verdicts)
+    return iocs, verdicts, tool_output_string
 
+def format_tool_output(iocs: dict, verdicts: dict) -> str:
+    """Renders the extraction and lookup results as the tool output text shown to the LLM."""
     tool_outputs_list = []
     tool_outputs_list.append("--- IoC Extraction Tool Output ---")
     if any(iocs.values()): # Check if any IoCs were actually found
         for ioc_type, values in iocs.items():
             if values: # Only process if there are values for this type
                 tool_outputs_list.append(f"Extracted {ioc_type.upper()}: {', '.join(values)}")
-                # Step 2: Agent uses "threat lookup" tool for each found IoC
                 for value in values:
-                    # Call simulate_threat_lookup with singular ioc_type (e.g., 'url' not 'urls')
-                    tool_outputs_list.append(simulate_threat_lookup(ioc_type.rstrip('s'), value))
+                    # Verdicts are keyed by the singular lookup type (e.g., 'url' not 'urls')
+                    tool_outputs_list.append(format_verdict(verdicts[(IOC_LOOKUP_TYPES[ioc_type], value)]))
     else:
         tool_outputs_list.append("No Indicators of Compromise (IoCs) extracted by tool.")
     tool_outputs_list.append("--------------------------------")
+    return "\n".join(tool_outputs_list)
+
+def build_analysis_prompt(input_text: str, iocs: dict, verdicts: dict, structured: bool = True) -> PromptParts:
+    """
+    Builds the compact analyst prompt: the static instructions go out as the model's system
+    instruction, and the prompt holds the (sampled) input plus summarized tool output.
+    """
+    parts = build_prompt_parts(input_text, iocs, verdicts, structured=structured)
+    sampled = ", input sampled to fit the budget" if parts.input_sampled else ""
+    print(f"LLM prompt: ~{parts.prompt_tokens} tokens for {len(input_text)} input characters{sampled}")
+    return parts
 
-    tool_output_string = "\n".join(tool_outputs_list)
+def verdict_to_dict(verdict) -> dict:
+    """JSON-friendly form of a threat intel verdict, used when streaming lookup results."""
+    return {
+        'type': verdict.ioc_type,
+        'value': verdict.value,
+        'verdict': verdict.verdict,
+        'detail': format_verdict(verdict),
+    }
+
+def answer_without_llm(input_text: str, iocs: dict, verdicts: dict, tool_output_string: str):
+    """
+    Tries to answer without calling the LLM: clearly benign or clearly malicious inputs get a
+    local triage report, and repeated inputs get their cached report.
+    Returns (analysis, cache_key); analysis is None when the LLM is needed.
+    """
+    if TRIAGE_ENABLED:
+        with timed('triage'):
+            triage = triage_input(input_text, iocs, verdicts)
+            if triage.decision != 'uncertain':
+                ANSWERS.inc('triage')
+                return dict(triage_report(triage, verdicts), source='triage'), None
+
+    with timed('report_cache'):
+        cache_key = report_cache.make_key(input_text, tool_output_string)
+        cached = report_cache.get(cache_key)
+    if cached is None:
+        return None, cache_key
+    try:
+        # Entries cached before reports were structured are still readable as text
+        analysis = check_report(parse_report(cached))
+    except ReportFormatError:
+        return None, cache_key
+    ANSWERS.inc('cache')
+    return dict(analysis, source='cache'), cache_key
+
+def finish_llm_report(text: str, verdicts: dict, cache_key: str, structured: bool = True) -> dict:
+    """
+    Parses an LLM reply into a structured report, fills in IoCs it left out, and caches it.
+    Raises ReportFormatError, without caching, when the reply fails the schema or has no severity.
+    """
+    with timed('report_parse'):
+        analysis = check_report(parse_structured_report(text) if structured else parse_report_text(text))
+    if not analysis['iocs']:
+        analysis['iocs'] = report_iocs(verdicts.values())
+    report_cache.set(cache_key, json.dumps(analysis))
+    return dict(analysis, source='llm')
+
+def _record_llm_outcome(error=None):
+    backend = get_llm_backend().name
+    if error is None:
+        LLM_CALLS.inc(backend, 'success')
+        ANSWERS.inc('llm')
+    else:
+        LLM_CALLS.inc(backend, 'error')
+        ERRORS.inc('llm')
 
+def fallback_report(input_text: str, iocs: dict, verdicts: dict, error: Exception) -> dict:
+    """
+    Local triage report used when the LLM fails, times out or is shed by the circuit breaker.
+    Uncertain inputs get triage's provisional severity. Fallback reports are not cached.
+    """
+    if isinstance(error, CircuitOpenError):
+        reason = "circuit breaker open after repeated failures"
+    elif isinstance(error, LLMTimeoutError):
+        reason = "request timed out"
+    elif is_transient_error(error):
+        reason = "service unavailable or rate limited"
+    elif isinstance(error, ReportFormatError):
+        reason = "the AI reply was not a valid report"
+    else:
+        reason = f"{type(error).__name__}"
+    print(f"ERROR: LLM analysis failed ({error}); falling back to local triage")
+    ANSWERS.inc('fallback')
+    triage = triage_input(input_text, iocs, verdicts, record=False)
+    return dict(triage_report(triage, verdicts, fallback_reason=reason), source='fallback')
+
+def analyze_threat_report(input_text: str) -> dict:
+    """
+    Orchestrates IoC extraction (tool use) and simulated lookups (tool use),
+    then uses the LLM (brain) to provide a structured threat analysis report:
+    a report_schema dict plus 'source' (triage, cache, llm or fallback).
+    """
+    iocs, verdicts, tool_output_string = run_agent_tools(input_text)
+    analysis, cache_key = answer_without_llm(input_text, iocs, verdicts, tool_output_string)
+    if analysis is not None:
+        return analysis
+    return generate_report(input_text, iocs, verdicts, cache_key)
+
+def analyze_threat_intelligence(input_text: str) -> str:
+    """analyze_threat_report rendered as the five-section text report."""
+    return render_report_text(analyze_threat_report(input_text))
+
+def generate_report(input_text: str, iocs: dict, verdicts: dict, cache_key: str) -> dict:
+    """Asks the LLM for the structured report once local answers are ruled out, and caches it under cache_key."""
     # Step 3: Agent's "brain" (LLM) analyzes original text AND tool outputs
-    prompt = f"""
-    You are a highly skilled and diligent Cybersecurity Threat Intelligence Analyst AI. Your primary mission is to identify, assess, and report on potential cyber threats. Your analysis must be comprehensive, actionable, and based solely on the provided information.
-
-    **IMPORTANT:**
-    - If you see a filename with a double extension (e.g., .pdf.exe, .docx.exe, .jpg.exe, .txt.exe, etc.), or a file that looks like a document but ends with .exe, .scr, .bat, .cmd, .js, or other executable extensions, you MUST treat it as a HIGH or CRITICAL threat. This is a classic malware and social engineering tactic. Clearly state this in your summary and severity.
-    - If the input text contains phrases like "password reset", "account compromised", "urgent action required", or similar, and includes a suspicious link (especially an external URL), you MUST treat this as a HIGH or CRITICAL threat. This is a classic phishing tactic. Clearly state this in your summary and severity, even if the link does not look obviously malicious.
-    - Any email or message that urges the user to click a link to reset a password, verify an account, or respond urgently, especially if it contains a link or asks for credentials, should be considered a likely phishing attempt and assigned HIGH or CRITICAL severity.
-    - However, a standard password change confirmation (e.g., "Your password was changed successfully. If you did not request this change, please contact support.") with NO suspicious links or urgent action requests should be considered safe and assigned LOW or INFORMATIONAL severity.
-
-    **Input Text (e.g., suspicious email, log snippet, URL to analyze):**
-    ```
-    {input_text}
-    ```
-
-    **Tool Outputs (from automated IoC extraction and threat lookups):**
-    ```
-    {tool_output_string}
-    ```
-
-    **Based on your comprehensive analysis of BOTH the Input Text AND the Tool Outputs, provide a clear, structured, and actionable threat intelligence report in the following format:**
-
-    1.  **Threat Summary:** A concise, high-level overview of the detected threat type (e.g., "Likely Phishing Attempt," "Potential Malware Distribution," "Suspicious Network Activity," "No Immediate Threat Detected").
-    2.  **Identified IoCs & Findings:**
-        * List all relevant IoCs (URLs, IPs, Emails) explicitly identified in the Input Text or Tool Outputs.
-        * For each IoC, summarize its nature (e.g., "Mismatched URL," "Known malicious IP," "Suspicious sender email").
-        * Mention any other key findings from the Input Text (e.g., social engineering tactics, unusual phrasing, unusual login patterns, or suspicious filenames/extensions).
-    3.  **Severity Assessment:** Assign an overall severity (e.g., `Informational`, `Low`, `Medium`, `High`, `Critical`) for this specific threat. Justify your reasoning, referencing both the input text and tool outputs.
-    4.  **Recommended Immediate Actions:** Provide concrete, prioritized steps for a user or IT security team to respond to this threat. Be specific and actionable.
-    5.  **Disclaimer:** Always include a disclaimer stating this is an AI-generated initial analysis and full human security assessment is required.
-
-    Generate the threat intelligence report now:
+    with timed('prompt_build'):
+        parts = build_analysis_prompt(input_text, iocs, verdicts)
+    try:
+        with timed('llm'):
+            text = get_llm_backend().generate(parts.prompt, parts.system_instruction, REPORT_SCHEMA)
+        analysis = finish_llm_report(text, verdicts, cache_key)
+    except Exception as e:
+        _record_llm_outcome(e)
+        return fallback_report(input_text, iocs, verdicts, e)
+    _record_llm_outcome()
+    return analysis
+
+async def analyze_threat_report_async(input_text: str) -> dict:
+    """
+    Async variant of analyze_threat_report for the ASGI app. The tools and the report
+    cache (SQLite behind a lock) run in worker threads and the LLM call uses the
+    non-blocking client, so the event loop is never held.
     """
+    iocs, verdicts, tool_output_string = await asyncio.to_thread(run_agent_tools, input_text)
+    analysis, cache_key = await asyncio.to_thread(answer_without_llm, input_text, iocs, verdicts, tool_output_string)
+    if analysis is not None:
+        return analysis
+
+    with timed('prompt_build'):
+        parts = build_analysis_prompt(input_text, iocs, verdicts)
+    try:
+        with timed('llm'):
+            text = await get_llm_backend().generate_async(parts.prompt, parts.system_instruction, REPORT_SCHEMA)
+        analysis = await asyncio.to_thread(finish_llm_report, text, verdicts, cache_key)
+    except Exception as e:
+        _record_llm_outcome(e)
+        return fallback_report(input_text, iocs, verdicts, e)
+    _record_llm_outcome()
+    return analysis
+
+def stream_threat_intelligence(input_text: str):
+    """
+    Streaming variant of analyze_threat_report. Yields (event, data) pairs:
+    ('iocs', dict) and ('lookups', list) as soon as the tools finish, then ('token', str)
+    for each chunk of report text as the LLM generates it, and finally ('analysis', dict)
+    with the structured report parsed from that text.
+    """
+    iocs, verdicts, tool_output_string = run_agent_tools(input_text)
+    yield 'iocs', iocs
+    yield 'lookups', [verdict_to_dict(verdict) for verdict in verdicts.values()]
+
+    analysis, cache_key = answer_without_llm(input_text, iocs, verdicts, tool_output_string)
+    if analysis is not None:
+        yield 'token', render_report_text(analysis)
+        yield 'analysis', analysis
+        return
+
+    # Streamed reports stay in the text layout so readers see them as they are written
+    with timed('prompt_build'):
+        parts = build_analysis_prompt(input_text, iocs, verdicts, structured=False)
+    chunks = []
     try:
-        response = llm_model.generate_content(prompt)
-        return response.text
+        # Timed as 'llm_stream' since it includes the time the client takes to read each event
+        with timed('llm_stream'):
+            for chunk in get_llm_backend().generate_stream(parts.prompt, parts.system_instruction):
+                chunks.append(chunk)
+                yield 'token', chunk
+        analysis = finish_llm_report("".join(chunks), verdicts, cache_key, structured=False)
     except Exception as e:
-        return f"Error analyzing threat intelligence: {e}. Please check API key and input."
+        _record_llm_outcome(e)
+        if chunks:
+            yield 'token', "\n\n--- AI analysis interrupted; local triage result follows ---\n\n"
+        analysis = fallback_report(input_text, iocs, verdicts, e)
+        yield 'token', render_report_text(analysis)
+        yield 'analysis', analysis
+        return
+    _record_llm_outcome()
+    yield 'analysis', analysis
 
 # --- Test the Function (for direct execution during development) ---
 if __name__ == "__main__":
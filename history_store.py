@@ -0,0 +1,262 @@
+"""
+Persistent analysis history.
+
+Analyses are stored in SQLite in WAL mode, so readers never block the writer and every
+gunicorn worker sees the same history. Rows are indexed by timestamp, severity and threat
+type, and the IoCs of each analysis go into a side table indexed by value and verdict.
+Pages are fetched with an id cursor, so a request costs the same no matter how large the
+table grows, and stats() aggregates in SQL rather than re-reading stored reports.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from ioc_extractor import extract_ioc_matches
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS analyses ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " created_at REAL NOT NULL,"
+    " severity TEXT NOT NULL,"
+    " input TEXT NOT NULL,"
+    " report TEXT NOT NULL,"
+    " mitigation TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_analyses_created_at ON analyses (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_analyses_severity ON analyses (severity, id)",
+    "CREATE TABLE IF NOT EXISTS analysis_iocs ("
+    " analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,"
+    " value TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_analysis_iocs_value ON analysis_iocs (value, analysis_id)",
+    "CREATE INDEX IF NOT EXISTS idx_analysis_iocs_analysis ON analysis_iocs (analysis_id)",
+)
+
+# Columns added for structured reports; databases created before them are migrated in place
+_ADDED_COLUMNS = (
+    ("analyses", "threat_type", "TEXT"),
+    ("analyses", "source", "TEXT"),
+    ("analyses", "analysis", "TEXT"),
+    ("analysis_iocs", "verdict", "TEXT NOT NULL DEFAULT 'unknown'"),
+)
+
+_ADDED_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_analyses_threat_type ON analyses (threat_type, id)",
+    "CREATE INDEX IF NOT EXISTS idx_analysis_iocs_verdict ON analysis_iocs (verdict, value)",
+    "CREATE INDEX IF NOT EXISTS idx_analysis_iocs_verdict_analysis ON analysis_iocs (verdict, analysis_id)",
+)
+
+_FLAGGED_VERDICTS = ("malicious", "suspicious")
+
+# Retention is enforced after every this many inserts rather than on each one
+_RETENTION_INTERVAL = 500
+
+
+def parse_history_time(value):
+    """Accepts an epoch timestamp or an ISO 8601 date/datetime. Returns epoch seconds, or None."""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class HistoryStore:
+    """SQLite-backed analysis history with cursor pagination, filtering and retention."""
+
+    def __init__(self, db_path: str, retention_days: float = 90, max_rows: int = 1000000):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._inserts = 0
+        self._inserts_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        for table, column, definition in _ADDED_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        for statement in _ADDED_INDEXES:
+            conn.execute(statement)
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; SQLite connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def add(self, result: dict) -> int:
+        """
+        Stores one analysis result (input, report, mitigation, severity and, when present,
+        threat_type and the structured analysis). Returns its id. The IoCs indexed are those
+        found in the input plus those listed in the analysis, with the analysis verdicts.
+        """
+        conn = self._conn()
+        analysis = result.get("analysis")
+        iocs = {entry["value"]: "unknown" for entry in extract_ioc_matches(result["input"])}
+        for entry in (analysis or {}).get("iocs", ()):
+            iocs[_normalize_ioc(entry["value"])] = entry["verdict"]
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO analyses (created_at, severity, input, report, mitigation, threat_type, source, analysis)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), result["severity"], result["input"], result["report"], json.dumps(result["mitigation"]),
+                 result.get("threat_type"), (analysis or {}).get("source"), json.dumps(analysis) if analysis else None),
+            )
+            analysis_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO analysis_iocs (analysis_id, value, verdict) VALUES (?, ?, ?)",
+                [(analysis_id, value, verdict) for value, verdict in iocs.items()],
+            )
+        with self._inserts_lock:
+            self._inserts += 1
+            due = self._inserts % _RETENTION_INTERVAL == 0
+        if due:
+            self.apply_retention()
+        return analysis_id
+
+    def query(self, limit: int = 50, cursor: int = None, severity: str = None, ioc: str = None,
+              since: float = None, until: float = None, threat_type: str = None, verdict: str = None) -> tuple:
+        """
+        Returns (items, next_cursor), newest first. Pass next_cursor back as cursor to fetch
+        the following page; it is None on the last page. verdict restricts the ioc filter to
+        that verdict, or without ioc selects analyses with any IoC of that verdict.
+        """
+        clauses = []
+        params = []
+        if cursor is not None:
+            clauses.append("a.id < ?")
+            params.append(cursor)
+        if severity:
+            clauses.append("a.severity = ?")
+            params.append(severity.capitalize())
+        if threat_type:
+            clauses.append("a.threat_type = ?")
+            params.append(threat_type.lower())
+        if since is not None:
+            clauses.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("a.created_at < ?")
+            params.append(until)
+        # IoC filters select analysis ids from the side table so a page reads about `limit` rows.
+        # An IoC value matches few analyses, so all of its ids are listed.
+        if ioc:
+            verdict_clause = " AND i.verdict = ?" if verdict else ""
+            clauses.append(f"a.id IN (SELECT i.analysis_id FROM analysis_iocs i WHERE i.value = ?{verdict_clause})")
+            params += [_normalize_ioc(ioc)] + ([verdict.lower()] if verdict else [])
+        elif verdict and not (severity or threat_type or since is not None or until is not None):
+            # Verdict alone: the next page of ids comes straight off the (verdict, analysis_id) index
+            cursor_clause = " AND i.analysis_id < ?" if cursor is not None else ""
+            clauses.append(f"a.id IN (SELECT DISTINCT i.analysis_id FROM analysis_iocs i WHERE i.verdict = ?{cursor_clause}"
+                           " ORDER BY i.analysis_id DESC LIMIT ?)")
+            params += [verdict.lower()] + ([cursor] if cursor is not None else []) + [limit + 1]
+        elif verdict:
+            # Combined with other filters: walk analyses newest first and probe the index per row
+            clauses.append("EXISTS (SELECT 1 FROM analysis_iocs i WHERE i.verdict = ? AND i.analysis_id = a.id)")
+            params.append(verdict.lower())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT a.id, a.created_at, a.severity, a.input, a.report, a.mitigation, a.threat_type, a.analysis"
+            f" FROM analyses a{where}"
+            " ORDER BY a.id DESC LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+        items = [
+            {
+                "id": row[0],
+                "timestamp": datetime.fromtimestamp(row[1]).isoformat(timespec="seconds"),
+                "severity": row[2],
+                "input": row[3],
+                "report": row[4],
+                "mitigation": json.loads(row[5]),
+                "threat_type": row[6],
+                "analysis": json.loads(row[7]) if row[7] else None,
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return items, next_cursor
+
+    def stats(self, since: float = None, until: float = None, top_iocs: int = 10) -> dict:
+        """
+        Aggregates the analyses created in [since, until): totals by severity, threat type
+        and day (local time), and the most frequently seen flagged IoCs.
+        """
+        clauses = []
+        params = []
+        if since is not None:
+            clauses.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("a.created_at < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._conn()
+
+        def grouped(expression):
+            return dict(conn.execute(
+                f"SELECT {expression}, COUNT(*) FROM analyses a{where} GROUP BY 1 ORDER BY 1", params).fetchall())
+
+        flagged_where = f"{where} AND" if where else " WHERE"
+        placeholders = ", ".join("?" for _ in _FLAGGED_VERDICTS)
+        rows = conn.execute(
+            f"SELECT i.value, i.verdict, COUNT(DISTINCT a.id) FROM analyses a JOIN analysis_iocs i ON i.analysis_id = a.id"
+            f"{flagged_where} i.verdict IN ({placeholders}) GROUP BY i.value, i.verdict ORDER BY 3 DESC, 1 LIMIT ?",
+            params + list(_FLAGGED_VERDICTS) + [top_iocs],
+        ).fetchall()
+        return {
+            "total": conn.execute(f"SELECT COUNT(*) FROM analyses a{where}", params).fetchone()[0],
+            "by_severity": grouped("a.severity"),
+            "by_threat_type": grouped("COALESCE(a.threat_type, 'unknown')"),
+            "by_day": grouped("date(a.created_at, 'unixepoch', 'localtime')"),
+            "top_flagged_iocs": [{"value": value, "verdict": verdict, "analyses": count} for value, verdict, count in rows],
+        }
+
+    def apply_retention(self) -> int:
+        """Deletes rows older than retention_days and the oldest rows beyond max_rows. Returns rows deleted."""
+        conn = self._conn()
+        deleted = 0
+        with conn:
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                deleted += conn.execute("DELETE FROM analyses WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_rows:
+                row = conn.execute("SELECT MAX(id) FROM analyses").fetchone()
+                if row[0] is not None:
+                    deleted += conn.execute("DELETE FROM analyses WHERE id <= ?", (row[0] - self.max_rows,)).rowcount
+        return deleted
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM analyses")
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+
+def _normalize_ioc(value):
+    """Normalizes a searched IoC the same way stored IoCs were normalized."""
+    matches = extract_ioc_matches(value.strip())
+    return matches[0]["value"] if matches else value.strip().lower()
+
+
+def history_store_from_env() -> HistoryStore:
+    """Builds the history store from HISTORY_DB, HISTORY_RETENTION_DAYS and HISTORY_MAX_ROWS."""
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_history.db")
+    return HistoryStore(
+        db_path=os.getenv("HISTORY_DB", default_path),
+        retention_days=float(os.getenv("HISTORY_RETENTION_DAYS", 90)),
+        max_rows=int(os.getenv("HISTORY_MAX_ROWS", 1000000)),
+    )
@@ -0,0 +1,158 @@
+"""
+Single-pass IoC extraction engine.
+
+All indicator patterns are combined into one precompiled regular expression and
+scanned with a single ``finditer`` pass. Each match is normalized, validated and
+deduplicated as it is found, and the character offsets of every occurrence are kept.
+
+Every pattern starts with a lookbehind that rejects matches beginning in the middle
+of a word, and every repetition is bounded, so the work per input position is
+constant and the scan stays linear-time on multi-megabyte log dumps. A shared
+guard in front of the alternation rejects positions inside a word or on a
+separator with a single check, so only word starts try the individual patterns.
+"""
+import ipaddress
+import re
+
+# Result keys of extract_iocs_from_text() for each IoC type. IPv4 and IPv6 share "ips".
+IOC_RESULT_KEYS = {
+    "url": "urls",
+    "ipv4": "ips",
+    "ipv6": "ips",
+    "email": "emails",
+    "domain": "domains",
+    "hash": "hashes",
+    "cve": "cves",
+    "filename": "filenames",
+}
+
+# Lookup type used by the threat intel tools for each result key
+IOC_LOOKUP_TYPES = {
+    "urls": "url",
+    "ips": "ip",
+    "emails": "email",
+    "domains": "domain",
+    "hashes": "hash",
+    "cves": "cve",
+    "filenames": "filename",
+}
+
+# Extensions that make a document-looking filename executable (e.g. invoice.pdf.exe)
+EXECUTABLE_EXTENSIONS = ("exe", "scr", "bat", "cmd", "js", "vbs", "com", "pif", "msi", "jar", "ps1", "hta", "lnk")
+DOCUMENT_EXTENSIONS = ("pdf", "docx", "doc", "xlsx", "xls", "pptx", "ppt", "txt", "rtf", "jpg", "jpeg", "png", "gif", "zip", "rar", "csv", "html", "htm")
+
+# Generic TLDs accepted for bare domains; any two-letter country code is accepted too.
+# Without this, dotted words such as user names (john.smith) would be reported as domains.
+_GENERIC_TLDS = frozenset((
+    "com", "net", "org", "info", "biz", "gov", "edu", "mil", "int", "io", "xyz", "top", "online", "site", "club",
+    "shop", "store", "app", "dev", "live", "icu", "click", "link", "win", "loan", "work", "support", "services",
+    "email", "cloud", "tech", "space", "website", "pro", "mobi", "name", "asia", "zip", "mov", "onion", "bank",
+))
+
+# File extensions that look like country-code TLDs; a bare "report.xlsx" or "setup.sh" is
+# not a domain. Extensions that are real generic TLDs (com, zip) stay domains.
+_FILE_SUFFIXES = frozenset(DOCUMENT_EXTENSIONS + EXECUTABLE_EXTENSIONS + (
+    "py", "sh", "log", "json", "xml", "yml", "yaml", "cfg", "ini", "conf", "dll", "sys", "tmp", "bak", "dat", "iso", "img", "md",
+)) - _GENERIC_TLDS
+
+_URL_TRAILING = ".,;:!?)]}>'\""
+
+_IOC_PATTERN = re.compile(
+    r"""
+    (?<!\w)(?=[\w:])
+    (?:(?P<url>(?<![\w.+-])(?:https?|hxxps?)://[^\s<>"'`]{1,2048})
+    |(?P<email>(?<![\w.%+-])[a-z0-9._%+-]{1,64}@(?:[a-z0-9-]{1,63}\.){1,8}[a-z]{2,24}(?![\w-]))
+    |(?P<cve>(?<![\w-])CVE-\d{4}-\d{4,7}(?!\w))
+    |(?P<hash>(?<!\w)(?:[0-9a-f]{64}|[0-9a-f]{40}|[0-9a-f]{32})(?!\w))
+    |(?P<ipv4>(?<![\w.])(?:\d{1,3}\.){3}\d{1,3}(?!\w|\.\d))
+    |(?P<ipv6>(?<![\w:.])(?:[0-9a-f]{0,4}:){2,7}(?:(?:\d{1,3}\.){3}\d{1,3}|[0-9a-f]{0,4})(?![\w:]|\.\d))
+    |(?P<filename>(?<![\w.-])[\w-][\w.-]{0,127}\.(?:""" + "|".join(DOCUMENT_EXTENSIONS) + r""")\.(?:""" + "|".join(EXECUTABLE_EXTENSIONS) + r""")(?!\w|\.\w))
+    |(?P<domain>(?<![\w.@/-])(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.){1,8}[a-z]{2,24}(?![\w-]|\.\w)))
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+
+def _normalize_url(value):
+    value = value.rstrip(_URL_TRAILING)
+    scheme, sep, rest = value.partition("://")
+    if not rest:
+        return None
+    host, slash, path = rest.partition("/")
+    return f"{scheme.lower()}{sep}{host.lower()}{slash}{path}"
+
+
+def _normalize_ipv4(value):
+    octets = value.split(".")
+    if any(int(octet) > 255 for octet in octets):
+        return None
+    # Drop leading zeros so 010.000.000.001 and 10.0.0.1 deduplicate
+    return ".".join(str(int(octet)) for octet in octets)
+
+
+def _normalize_ipv6(value):
+    try:
+        address = ipaddress.IPv6Address(value)
+    except ValueError:
+        # Timestamps such as 09:00:01 also match the loose IPv6 shape
+        return None
+    if address.ipv4_mapped:
+        # Keep the dotted form (::ffff:1.2.3.4) on every Python version
+        return f"::ffff:{address.ipv4_mapped}"
+    return None if address.is_unspecified else address.compressed
+
+
+def _normalize_domain(value):
+    value = value.lower().rstrip(".")
+    tld = value.rsplit(".", 1)[-1]
+    if tld in _FILE_SUFFIXES or (len(tld) != 2 and tld not in _GENERIC_TLDS):
+        return None
+    return value
+
+
+_NORMALIZERS = {
+    "url": _normalize_url,
+    "ipv4": _normalize_ipv4,
+    "ipv6": _normalize_ipv6,
+    "email": str.lower,
+    "domain": _normalize_domain,
+    "hash": str.lower,
+    "cve": str.upper,
+    "filename": str.lower,
+}
+
+
+def extract_ioc_matches(text: str) -> list:
+    """
+    Scans the text once and returns one entry per unique IoC, in order of first appearance:
+    {"type": "ipv4", "value": "185.123.45.67", "offsets": [12, 340]}.
+    """
+    found = {}
+    for match in _IOC_PATTERN.finditer(text):
+        ioc_type = match.lastgroup
+        value = _NORMALIZERS[ioc_type](match.group(ioc_type))
+        if not value:
+            continue
+        entry = found.get((ioc_type, value))
+        if entry is None:
+            found[(ioc_type, value)] = {"type": ioc_type, "value": value, "offsets": [match.start()]}
+        else:
+            entry["offsets"].append(match.start())
+    return list(found.values())
+
+
+def group_ioc_matches(matches: list) -> dict:
+    """Groups extract_ioc_matches() output into the per-type lists used by the agent tools."""
+    iocs = {key: [] for key in dict.fromkeys(IOC_RESULT_KEYS.values())}
+    for entry in matches:
+        iocs[IOC_RESULT_KEYS[entry["type"]]].append(entry["value"])
+    return iocs
+
+
+def extract_iocs_from_text(text: str) -> dict:
+    """
+    IoC extraction tool. Extracts URLs, IPv4/IPv6 addresses, email addresses, domains,
+    file hashes, CVE IDs and double-extension filenames, deduplicated and normalized.
+    This function represents a 'tool' the AI agent can conceptually 'use'.
+    """
+    return group_ioc_matches(extract_ioc_matches(text))
@@ -0,0 +1,256 @@
+"""
+Chunked map-reduce analysis for large log files.
+
+The log is read incrementally (iter_log_lines) and grouped into bounded chunks
+(iter_chunks). Each chunk goes through the normal pipeline on a shared worker pool:
+IoC extraction, threat lookups, local triage and the report cache, and an LLM call only
+while the per-log LLM budget lasts. Results are folded into a LogAnalysis as they
+complete, which deduplicates IoCs across the whole log and keeps only the most severe
+findings. Memory is bounded by the chunk size, the number of chunks in flight and the
+IoC cap, never by the size of the file.
+"""
+import codecs
+import heapq
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cyber_agent_core import answer_without_llm, generate_report, run_agent_tools
+from report_schema import render_report_text, report_iocs
+from threat_intel import VERDICT_SEVERITY
+from metrics import ERRORS
+
+LOG_CHUNK_CHARS = int(os.getenv("LOG_CHUNK_CHARS", 4000))
+LOG_MAX_LINE_CHARS = int(os.getenv("LOG_MAX_LINE_CHARS", 2000))
+LOG_MAX_WORKERS = int(os.getenv("LOG_MAX_WORKERS", 8))
+LOG_MAX_IN_FLIGHT = int(os.getenv("LOG_MAX_IN_FLIGHT", 32))
+LOG_MAX_LLM_CHUNKS = int(os.getenv("LOG_MAX_LLM_CHUNKS", 50))
+LOG_MAX_IOCS = int(os.getenv("LOG_MAX_IOCS", 10000))
+LOG_TOP_FINDINGS = 20
+
+SEVERITY_RANK = {"Unknown": 0, "Informational": 1, "Low": 2, "Medium": 3, "High": 4, "Critical": 5}
+
+# Severity given to chunks that were neither triaged locally nor sent to the LLM
+_VERDICT_TO_SEVERITY = {"malicious": "High", "suspicious": "Medium"}
+
+LogChunk = namedtuple("LogChunk", ["index", "first_line", "last_line", "text"])
+ChunkResult = namedtuple("ChunkResult", ["index", "first_line", "last_line", "source", "severity", "threat_type",
+                                         "summary", "actions", "verdicts"])
+
+# Shared by all log analyses, so concurrent uploads cannot multiply the number of threads
+log_executor = ThreadPoolExecutor(max_workers=LOG_MAX_WORKERS, thread_name_prefix="log-analysis")
+
+
+def iter_log_lines(stream, encoding="utf-8", block_size=65536, max_line_chars=LOG_MAX_LINE_CHARS):
+    """
+    Yields the lines of a binary or text stream without reading it all. Undecodable bytes
+    become U+FFFD, and lines longer than max_line_chars are truncated.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    skipping = False  # inside the remainder of a truncated line
+    while True:
+        block = stream.read(block_size)
+        pending += block if isinstance(block, str) else decoder.decode(block, final=not block)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            yield line.rstrip("\r")[:max_line_chars]
+        if len(pending) > max_line_chars:
+            if not skipping:
+                yield pending[:max_line_chars]
+            skipping = True
+            pending = ""
+        if not block:
+            break
+    if pending and not skipping:
+        yield pending.rstrip("\r")
+
+
+def iter_chunks(lines, max_chars=LOG_CHUNK_CHARS):
+    """Groups non-blank lines into LogChunks of at most max_chars characters, keeping line numbers."""
+    buffer = []
+    size = 0
+    first_line = last_line = 0
+    index = 0
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if buffer and size + len(line) + 1 > max_chars:
+            yield LogChunk(index, first_line, last_line, "\n".join(buffer))
+            index += 1
+            buffer = []
+            size = 0
+        if not buffer:
+            first_line = line_number
+        buffer.append(line)
+        size += len(line) + 1
+        last_line = line_number
+    if buffer:
+        yield LogChunk(index, first_line, last_line, "\n".join(buffer))
+
+
+def analyze_chunk(chunk: LogChunk, llm_budget: threading.Semaphore) -> ChunkResult:
+    """Map step: runs one chunk through the pipeline, using the LLM only if the budget allows."""
+    try:
+        iocs, verdicts, tool_output_string = run_agent_tools(chunk.text)
+        analysis, cache_key = answer_without_llm(chunk.text, iocs, verdicts, tool_output_string)
+        if analysis is None and llm_budget.acquire(blocking=False):
+            analysis = generate_report(chunk.text, iocs, verdicts, cache_key)
+    except Exception as e:
+        print(f"ERROR: Log chunk {chunk.index} (lines {chunk.first_line}-{chunk.last_line}) failed: {e}")
+        ERRORS.inc("log_chunk")
+        return ChunkResult(chunk.index, chunk.first_line, chunk.last_line, "error", "Unknown", "none",
+                           f"Chunk analysis failed: {e}", [], [])
+
+    flagged = list(verdicts.values())
+    if analysis is None:
+        # Over the LLM budget: rate the chunk from its threat lookups alone
+        worst = max((v.verdict for v in flagged), key=VERDICT_SEVERITY.get, default="unknown")
+        severity = _VERDICT_TO_SEVERITY.get(worst, "Low")
+        return ChunkResult(chunk.index, chunk.first_line, chunk.last_line, "lookups", severity,
+                           "suspicious_activity" if worst in _VERDICT_TO_SEVERITY else "none",
+                           "Not analyzed by the LLM (budget exhausted); rated from threat lookups", [], flagged)
+
+    return ChunkResult(
+        chunk.index, chunk.first_line, chunk.last_line, analysis["source"], analysis["severity"],
+        analysis["threat_type"], analysis["summary"], analysis["actions"], flagged,
+    )
+
+
+class LogAnalysis:
+    """Reduce step: folds chunk results into totals, deduplicated IoCs and the top findings."""
+
+    def __init__(self, max_iocs: int = LOG_MAX_IOCS, top_findings: int = LOG_TOP_FINDINGS):
+        self.max_iocs = max_iocs
+        self.top_findings = top_findings
+        self.lines = 0
+        self.chunks = 0
+        self.sources = {}
+        self.severity_counts = {}
+        self.threat_counts = {}
+        self.severity = "Unknown"
+        self.iocs = {}  # (type, value) -> worst verdict, capped at max_iocs
+        self.iocs_dropped = 0
+        self._findings = []  # min-heap of (rank, -index, result)
+
+    def add(self, result: ChunkResult):
+        self.chunks += 1
+        self.lines = max(self.lines, result.last_line)
+        self.sources[result.source] = self.sources.get(result.source, 0) + 1
+        self.severity_counts[result.severity] = self.severity_counts.get(result.severity, 0) + 1
+        self.threat_counts[result.threat_type] = self.threat_counts.get(result.threat_type, 0) + 1
+        if SEVERITY_RANK.get(result.severity, 0) > SEVERITY_RANK[self.severity]:
+            self.severity = result.severity
+
+        for verdict in result.verdicts:
+            key = (verdict.ioc_type, verdict.value)
+            known = self.iocs.get(key)
+            if known is None:
+                if len(self.iocs) >= self.max_iocs:
+                    self.iocs_dropped += 1
+                    continue
+                self.iocs[key] = verdict
+            elif VERDICT_SEVERITY[verdict.verdict] > VERDICT_SEVERITY[known.verdict]:
+                self.iocs[key] = verdict
+
+        # Keep only the most severe chunks (earliest first on ties) for the merged report
+        entry = (SEVERITY_RANK.get(result.severity, 0), -result.index, result)
+        if len(self._findings) < self.top_findings:
+            heapq.heappush(self._findings, entry)
+        elif entry[:2] > self._findings[0][:2]:
+            heapq.heapreplace(self._findings, entry)
+
+    def flagged_iocs(self):
+        flagged = [v for v in self.iocs.values() if v.verdict in ("malicious", "suspicious")]
+        return sorted(flagged, key=lambda v: (-VERDICT_SEVERITY[v.verdict], v.ioc_type, v.value))
+
+    def stats(self) -> dict:
+        return {
+            "lines": self.lines,
+            "chunks": self.chunks,
+            "chunk_sources": dict(self.sources),
+            "severity_counts": dict(self.severity_counts),
+            "threat_type_counts": dict(self.threat_counts),
+            "distinct_iocs": len(self.iocs),
+            "iocs_dropped": self.iocs_dropped,
+            "flagged_iocs": len(self.flagged_iocs()),
+        }
+
+    def to_report(self, max_listed_iocs: int = 50, max_actions: int = 10) -> dict:
+        """Merged structured report (see report_schema), in the same shape as a single-input report."""
+        findings = sorted((entry[2] for entry in self._findings), key=lambda r: r.index)
+        notable = [r for r in findings if SEVERITY_RANK.get(r.severity, 0) >= SEVERITY_RANK["Medium"]]
+        worst = max(notable, key=lambda r: (SEVERITY_RANK.get(r.severity, 0), -r.index), default=None)
+        if worst is None:
+            summary, threat_type = "No Immediate Threat Detected", "none"
+        else:
+            summary, threat_type = worst.summary, worst.threat_type
+
+        flagged = self.flagged_iocs()
+        finding_lines = [f"{len(self.iocs)} distinct IoCs, {len(flagged)} flagged by threat intel"]
+        if len(flagged) > max_listed_iocs:
+            finding_lines.append(f"... and {len(flagged) - max_listed_iocs} more flagged IoCs")
+        if self.iocs_dropped:
+            finding_lines.append(f"IoC tracking capped at {self.max_iocs} distinct values; {self.iocs_dropped} further sightings not tracked")
+        finding_lines += [f"Lines {r.first_line}-{r.last_line} [{r.severity}]: {r.summary}" for r in notable]
+
+        actions = []
+        for result in sorted(findings, key=lambda r: -SEVERITY_RANK.get(r.severity, 0)):
+            for action in result.actions:
+                if action not in actions:
+                    actions.append(action)
+        actions = actions[:max_actions] or ["No specific action required. Continue routine monitoring."]
+
+        counts = ", ".join(f"{severity} {self.severity_counts[severity]}"
+                           for severity in sorted(self.severity_counts, key=lambda s: -SEVERITY_RANK.get(s, 0)))
+        sources = ", ".join(f"{count} {source}" for source, count in sorted(self.sources.items()))
+        return {
+            "summary": f"{summary} (log of {self.lines} lines analyzed in {self.chunks} chunks)",
+            "threat_type": threat_type,
+            "severity": self.severity,
+            "severity_justification": f"Highest severity across all chunks. Chunks by severity: {counts or 'none'}. "
+                                      f"Chunks by source: {sources or 'none'}.",
+            "iocs": report_iocs(flagged, max_listed_iocs),
+            "findings": finding_lines,
+            "actions": actions,
+            "disclaimer": "This is an automated consolidation of per-chunk analyses of a large log. "
+                          "A full human security assessment is required.",
+            "source": "log",
+        }
+
+
+def analyze_log_stream(stream, max_in_flight: int = LOG_MAX_IN_FLIGHT, max_llm_chunks: int = LOG_MAX_LLM_CHUNKS,
+                       chunk_chars: int = LOG_CHUNK_CHARS, executor: ThreadPoolExecutor = None) -> LogAnalysis:
+    """
+    Analyzes a log from a file-like object. At most max_in_flight chunks are queued or running
+    at once, so reading pauses while the workers catch up.
+    """
+    executor = executor or log_executor
+    llm_budget = threading.Semaphore(max_llm_chunks)
+    analysis = LogAnalysis()
+    pending = set()
+    for chunk in iter_chunks(iter_log_lines(stream), chunk_chars):
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                analysis.add(future.result())
+        pending.add(executor.submit(analyze_chunk, chunk, llm_budget))
+    for future in wait(pending).done:
+        analysis.add(future.result())
+    return analysis
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python log_analysis.py <log file>")
+    with open(sys.argv[1], "rb") as f:
+        result = analyze_log_stream(f)
+    print(render_report_text(result.to_report()))
+    print(result.stats())
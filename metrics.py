@@ -0,0 +1,187 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts keyed by label values behind one lock, so an
+observation costs a perf_counter() call, a bisect and a dict update (about a
+microsecond) and can stay on in production. Values that already live elsewhere
+(cache hit counters, triage decisions) are exported by registered collectors at
+scrape time instead of being double-counted on the hot path. Metrics are per process;
+with several gunicorn workers each worker reports its own series.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond regex scans up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with _lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def register_collector(collector):
+    """
+    Registers a callable run at scrape time. It returns an iterable of
+    (name, type, help_text, [(labels_dict, value), ...]) tuples.
+    """
+    with _lock:
+        _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+        # Snapshot under the lock so a scrape never sees a half-updated histogram
+        lines = [line for metric in metrics for line in metric.render()]
+    for collector in collectors:
+        for name, metric_type, help_text, samples in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Pipeline metrics ---
+STAGE_SECONDS = Histogram(
+    "cyberguard_stage_duration_seconds",
+    "Time spent in each stage of the analysis pipeline.",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "cyberguard_http_request_duration_seconds",
+    "Time until the response is returned, by endpoint (streaming bodies excluded).",
+    ("endpoint", "method", "status"),
+)
+LLM_TOKENS = Counter(
+    "cyberguard_llm_tokens_total",
+    "LLM tokens used, by backend and direction (prompt or output). Estimated when the backend reports none.",
+    ("backend", "direction"),
+)
+LLM_CALLS = Counter(
+    "cyberguard_llm_calls_total",
+    "LLM calls by backend and outcome.",
+    ("backend", "outcome"),
+)
+LLM_RETRIES = Counter(
+    "cyberguard_llm_retries_total",
+    "LLM call attempts retried after a transient failure or timeout.",
+    ("backend",),
+)
+LLM_COALESCED = Counter(
+    "cyberguard_llm_coalesced_total",
+    "LLM requests served by joining an identical request already in flight.",
+    ("backend",),
+)
+LLM_BREAKER_REJECTIONS = Counter(
+    "cyberguard_llm_breaker_rejections_total",
+    "LLM requests failed fast because the circuit breaker was open.",
+    ("backend",),
+)
+ERRORS = Counter(
+    "cyberguard_errors_total",
+    "Errors by component.",
+    ("component",),
+)
+ANSWERS = Counter(
+    "cyberguard_analysis_answers_total",
+    "Completed analyses by where the report came from (triage, cache, llm or fallback).",
+    ("source",),
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """Records the duration of the enclosed block in the stage histogram, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for backends that report no usage."""
+    return (len(text) + 3) // 4
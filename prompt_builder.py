@@ -0,0 +1,156 @@
+"""
+Compact prompt construction for the analyst LLM.
+
+The fixed analyst instructions are sent once per model as its system instruction
+(SYSTEM_INSTRUCTION) instead of being repeated in every request. The per-request prompt
+holds only the input and a summary of the tool output: lookups of the same type and
+verdict are merged into one line, and the lists of values and details are capped so the
+summary takes at most half of LLM_PROMPT_TOKEN_BUDGET. Input that would push the prompt past LLM_PROMPT_TOKEN_BUDGET is sampled:
+the head and tail are kept along with the middle lines that mention flagged IoCs or
+threat phrases.
+"""
+import os
+from collections import namedtuple
+
+from metrics import estimate_tokens
+from threat_intel import VERDICT_SEVERITY, type_label
+
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 6000))
+# Values listed per merged lookup line; flagged IoCs are listed more generously
+PROMPT_MAX_FLAGGED_VALUES = 25
+PROMPT_MAX_OTHER_VALUES = 8
+# Distinct lookup details per line (blocklist hits name their matched entry), and their length
+PROMPT_MAX_DETAILS = 5
+PROMPT_MAX_DETAIL_CHARS = 200
+PROMPT_MAX_TOOL_LINES = 20
+
+_ANALYST_RULES = """You are a highly skilled and diligent Cybersecurity Threat Intelligence Analyst AI. Your primary mission is to identify, assess, and report on potential cyber threats. Your analysis must be comprehensive, actionable, and based solely on the provided information.
+
+Each request contains an Input Text (e.g., suspicious email, log snippet, URL to analyze) and Tool Outputs from automated IoC extraction and threat lookups. Lookups with the same result are merged into one line, and very long inputs are sampled, with omitted lines marked.
+
+**IMPORTANT:**
+- If you see a filename with a double extension (e.g., .pdf.exe, .docx.exe, .jpg.exe, .txt.exe, etc.), or a file that looks like a document but ends with .exe, .scr, .bat, .cmd, .js, or other executable extensions, you MUST treat it as a HIGH or CRITICAL threat. This is a classic malware and social engineering tactic. Clearly state this in your summary and severity.
+- If the input text contains phrases like "password reset", "account compromised", "urgent action required", or similar, and includes a suspicious link (especially an external URL), you MUST treat this as a HIGH or CRITICAL threat. This is a classic phishing tactic. Clearly state this in your summary and severity, even if the link does not look obviously malicious.
+- Any email or message that urges the user to click a link to reset a password, verify an account, or respond urgently, especially if it contains a link or asks for credentials, should be considered a likely phishing attempt and assigned HIGH or CRITICAL severity.
+- However, a standard password change confirmation (e.g., "Your password was changed successfully. If you did not request this change, please contact support.") with NO suspicious links or urgent action requests should be considered safe and assigned LOW or INFORMATIONAL severity.
+
+"""
+
+# Text layout, used for streamed reports
+SYSTEM_INSTRUCTION = _ANALYST_RULES + """**Based on your comprehensive analysis of BOTH the Input Text AND the Tool Outputs, provide a clear, structured, and actionable threat intelligence report in the following format:**
+
+1.  **Threat Summary:** A concise, high-level overview of the detected threat type (e.g., "Likely Phishing Attempt," "Potential Malware Distribution," "Suspicious Network Activity," "No Immediate Threat Detected").
+2.  **Identified IoCs & Findings:**
+    * List all relevant IoCs (URLs, IPs, Emails, Domains, Hashes, CVEs, Filenames) explicitly identified in the Input Text or Tool Outputs.
+    * For each IoC, summarize its nature (e.g., "Mismatched URL," "Known malicious IP," "Suspicious sender email").
+    * Mention any other key findings from the Input Text (e.g., social engineering tactics, unusual phrasing, unusual login patterns, or suspicious filenames/extensions).
+3.  **Severity Assessment:** Assign an overall severity (e.g., `Informational`, `Low`, `Medium`, `High`, `Critical`) for this specific threat. Justify your reasoning, referencing both the input text and tool outputs.
+4.  **Recommended Immediate Actions:** Provide concrete, prioritized steps for a user or IT security team to respond to this threat. Be specific and actionable.
+5.  **Disclaimer:** Always include a disclaimer stating this is an AI-generated initial analysis and full human security assessment is required."""
+
+# JSON layout matching report_schema.REPORT_SCHEMA, used for everything else
+STRUCTURED_SYSTEM_INSTRUCTION = _ANALYST_RULES + """**Based on your comprehensive analysis of BOTH the Input Text AND the Tool Outputs, reply with a single JSON object with these fields:**
+
+- "summary": A concise, high-level overview of the detected threat (e.g., "Likely Phishing Attempt," "Potential Malware Distribution," "No Immediate Threat Detected").
+- "threat_type": One of "phishing", "malware", "ransomware", "fraud", "malicious_infrastructure", "suspicious_activity", "none".
+- "severity": One of "Informational", "Low", "Medium", "High", "Critical".
+- "severity_justification": Your reasoning, referencing both the input text and tool outputs.
+- "iocs": Every relevant IoC as {"type", "value", "verdict", "note"}, where verdict is one of "malicious", "suspicious", "internal", "clean", "unknown" and note summarizes its nature (e.g., "Mismatched URL," "Known malicious IP").
+- "findings": Other key findings from the Input Text (e.g., social engineering tactics, unusual login patterns, suspicious filenames/extensions).
+- "actions": Concrete, prioritized steps for a user or IT security team to respond to this threat."""
+
+# Middle lines of a sampled input are kept when they mention one of these
+_SAMPLE_PHRASES = (
+    "password", "account", "urgent", "verify", "login", "failed", "denied", "blocked", "alert",
+    "malware", "ransom", "encrypted", "bitcoin", "payment", "transfer", "attachment", ".exe",
+)
+
+PromptParts = namedtuple("PromptParts", ["system_instruction", "prompt", "prompt_tokens", "input_sampled"])
+
+
+def summarize_tool_output(iocs: dict, verdicts: dict, max_tokens: int = None) -> str:
+    """
+    Tool output for the LLM with one line per (type, verdict): flagged indicators first, each
+    line with its first few distinct details and a capped list of values. With max_tokens,
+    the value and detail lists are shortened until the summary fits.
+    """
+    groups = {}
+    for verdict in verdicts.values():
+        groups.setdefault((verdict.ioc_type, verdict.verdict), []).append(verdict)
+    ordered = sorted(groups.items(), key=lambda item: (-VERDICT_SEVERITY.get(item[0][1], 0), item[0][0]))[:PROMPT_MAX_TOOL_LINES]
+
+    flagged_limit, other_limit, detail_limit = PROMPT_MAX_FLAGGED_VALUES, PROMPT_MAX_OTHER_VALUES, PROMPT_MAX_DETAILS
+    while True:
+        summary = _render_tool_summary(ordered, flagged_limit, other_limit, detail_limit)
+        if max_tokens is None or estimate_tokens(summary) <= max_tokens or flagged_limit == other_limit == detail_limit == 1:
+            return summary
+        flagged_limit, other_limit, detail_limit = max(1, flagged_limit // 2), max(1, other_limit // 2), max(1, detail_limit // 2)
+
+
+def _render_tool_summary(ordered, flagged_limit, other_limit, detail_limit):
+    lines = ["--- IoC Extraction Tool Output ---"]
+    if not ordered:
+        lines.append("No Indicators of Compromise (IoCs) extracted by tool.")
+    for (ioc_type, verdict), entries in ordered:
+        flagged = VERDICT_SEVERITY.get(verdict, 0) >= VERDICT_SEVERITY["suspicious"]
+        limit = flagged_limit if flagged else other_limit
+        details = list(dict.fromkeys(entry.detail[:PROMPT_MAX_DETAIL_CHARS] for entry in entries))
+        detail = " | ".join(details[:detail_limit]) + (f" (+{len(details) - detail_limit} other details)" if len(details) > detail_limit else "")
+        shown = ", ".join(f"'{entry.value}'" for entry in entries[:limit])
+        more = f" (+{len(entries) - limit} more)" if len(entries) > limit else ""
+        lines.append(f"{type_label(ioc_type)} x{len(entries)} [{verdict.upper()}] {detail} -> {shown}{more}")
+    lines.append("--------------------------------")
+    return "\n".join(lines)
+
+
+def sample_input(input_text: str, max_chars: int, keep_values=()) -> str:
+    """
+    Shortens input_text to about max_chars: 40% head, 20% tail, and up to 40% of middle
+    lines that mention a flagged IoC or a threat phrase. Omitted runs are marked in place.
+    """
+    if len(input_text) <= max_chars:
+        return input_text
+    head = input_text[:int(max_chars * 0.4)].rsplit("\n", 1)[0]
+    tail = input_text[-int(max_chars * 0.2):].split("\n", 1)[-1]
+    middle = input_text[len(head):len(input_text) - len(tail)].split("\n")
+    middle_budget = max_chars - len(head) - len(tail)
+    needles = tuple(value.lower() for value in keep_values) + _SAMPLE_PHRASES
+
+    parts = [head]
+    omitted = 0
+    for line in middle:
+        lowered = line.lower()
+        if line.strip() and len(line) < middle_budget and any(needle in lowered for needle in needles):
+            if omitted:
+                parts.append(f"[... {omitted} lines omitted ...]")
+                omitted = 0
+            parts.append(line)
+            middle_budget -= len(line) + 1
+        else:
+            omitted += 1
+    if omitted:
+        parts.append(f"[... {omitted} lines omitted ...]")
+    parts.append(tail)
+    return "\n".join(parts)
+
+
+def build_prompt_parts(input_text: str, iocs: dict, verdicts: dict, token_budget: int = None,
+                       structured: bool = True) -> PromptParts:
+    """
+    Builds the per-request prompt within the token budget, for STRUCTURED_SYSTEM_INSTRUCTION
+    (JSON reply) or, with structured=False, SYSTEM_INSTRUCTION (text reply).
+    """
+    token_budget = LLM_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    # Tool results take priority but get at most half the budget; the input gets whatever
+    # is left, at least 1000 characters
+    tool_summary = summarize_tool_output(iocs, verdicts, max_tokens=token_budget // 2)
+    flagged = [v.value for v in verdicts.values() if VERDICT_SEVERITY.get(v.verdict, 0) >= VERDICT_SEVERITY["suspicious"]][:50]
+    input_chars = max(1000, (token_budget - estimate_tokens(tool_summary) - 50) * 4)
+    sampled = sample_input(input_text, input_chars, flagged)
+    prompt = (
+        f"**Input Text:**\n```\n{sampled}\n```\n\n"
+        f"**Tool Outputs:**\n```\n{tool_summary}\n```\n\n"
+        + ("Generate the threat intelligence report JSON now:" if structured else "Generate the threat intelligence report now:")
+    )
+    system_instruction = STRUCTURED_SYSTEM_INSTRUCTION if structured else SYSTEM_INSTRUCTION
+    return PromptParts(system_instruction, prompt, estimate_tokens(prompt), sampled is not input_text)
@@ -0,0 +1,249 @@
+"""
+Structured analysis reports.
+
+The LLM is asked for JSON matching REPORT_SCHEMA (Gemini response_mime_type and
+response_schema), and parse_structured_report() validates the reply. Streamed text reports
+and older cached reports are read from the five-section text layout in a single pass.
+A reply that fails validation, or a text report without a severity, is rejected with
+ReportFormatError rather than guessed at. Every report ends up as the same dict, so
+callers read severity, threat type and actions from fields instead of scanning report text.
+"""
+import json
+import re
+
+SEVERITIES = ("Informational", "Low", "Medium", "High", "Critical")
+THREAT_TYPES = ("phishing", "malware", "ransomware", "fraud", "malicious_infrastructure", "suspicious_activity", "none")
+IOC_VERDICTS = ("malicious", "suspicious", "internal", "clean", "unknown")
+
+
+def _enum(values):
+    return {"type": "string", "format": "enum", "enum": list(values)}
+
+
+REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "threat_type": _enum(THREAT_TYPES),
+        "severity": _enum(SEVERITIES),
+        "severity_justification": {"type": "string"},
+        "iocs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string"},
+                    "value": {"type": "string"},
+                    "verdict": _enum(IOC_VERDICTS),
+                    "note": {"type": "string"},
+                },
+                "required": ["type", "value", "verdict"],
+            },
+        },
+        "findings": {"type": "array", "items": {"type": "string"}},
+        "actions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "threat_type", "severity", "severity_justification", "iocs", "findings", "actions"],
+}
+
+DEFAULT_DISCLAIMER = "This is an AI-generated initial analysis. A full human security assessment is required."
+
+# Used as mitigation when a report recommends no actions
+DEFAULT_MITIGATION = {
+    "phishing": "Warn users not to click suspicious links or provide credentials.",
+    "malware": "Run a full antivirus scan and isolate affected systems.",
+    "ransomware": "Disconnect infected machines and restore from backups.",
+    "none": "No specific mitigation required. Monitor for unusual activity.",
+}
+
+# Threat type of a text report, judged from its one-line summary only
+_SUMMARY_THREAT_TYPES = (
+    ("ransom", "ransomware"),
+    ("phish", "phishing"),
+    ("malware", "malware"),
+    ("fraud", "fraud"),
+    ("social engineering", "fraud"),
+    ("malicious infrastructure", "malicious_infrastructure"),
+    ("no immediate threat", "none"),
+    ("no threat", "none"),
+    ("benign", "none"),
+)
+
+_SECTION_PATTERN = re.compile(
+    r"^[\s#*]*([1-5])\.\s*\**\s*(Threat Summary|Identified IoCs & Findings|Severity Assessment|"
+    r"Recommended Immediate Actions|Disclaimer)\s*\**\s*:?\s*\**\s*(.*)$",
+    re.IGNORECASE,
+)
+_SEVERITY_PATTERN = re.compile(r"\b(Informational|Low|Medium|High|Critical)\b", re.IGNORECASE)
+_BULLET_PATTERN = re.compile(r"^\s*(?:[*\-•]|\d+[.)])\s+(.*)$")
+
+
+class ReportFormatError(ValueError):
+    """A structured report is missing required fields or has invalid values."""
+
+
+def _text_list(value, field):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ReportFormatError(f"'{field}' must be a list")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def validate_report(data) -> dict:
+    """Checks a decoded JSON report against REPORT_SCHEMA and returns it normalized."""
+    if not isinstance(data, dict):
+        raise ReportFormatError("report must be a JSON object")
+    summary = str(data.get("summary") or "").strip()
+    if not summary:
+        raise ReportFormatError("'summary' is required")
+    severity = str(data.get("severity") or "").strip().capitalize()
+    if severity not in SEVERITIES:
+        raise ReportFormatError(f"invalid severity {data.get('severity')!r}")
+    threat_type = str(data.get("threat_type") or "").strip().lower().replace(" ", "_")
+    if threat_type not in THREAT_TYPES:
+        raise ReportFormatError(f"invalid threat_type {data.get('threat_type')!r}")
+
+    iocs = []
+    for entry in data.get("iocs") or []:
+        if not isinstance(entry, dict) or not entry.get("value"):
+            raise ReportFormatError("each IoC needs a 'value'")
+        verdict = str(entry.get("verdict") or "unknown").lower()
+        iocs.append({
+            "type": str(entry.get("type") or "unknown").lower(),
+            "value": str(entry["value"]),
+            "verdict": verdict if verdict in IOC_VERDICTS else "unknown",
+            "note": str(entry.get("note") or ""),
+        })
+
+    return {
+        "summary": summary,
+        "threat_type": threat_type,
+        "severity": severity,
+        "severity_justification": str(data.get("severity_justification") or "").strip(),
+        "iocs": iocs,
+        "findings": _text_list(data.get("findings"), "findings"),
+        "actions": _text_list(data.get("actions"), "actions"),
+        "disclaimer": str(data.get("disclaimer") or DEFAULT_DISCLAIMER),
+    }
+
+
+def parse_report_text(text: str) -> dict:
+    """
+    Reads a report in the five-section text layout in one pass over its lines. Severity is
+    the first severity word of the 'Severity Assessment' section, or 'Unknown' without one.
+    """
+    section = None
+    summary = ""
+    severity = None
+    justification = []
+    findings = []
+    actions = []
+    disclaimer = ""
+    for line in text.splitlines():
+        header = _SECTION_PATTERN.match(line)
+        if header:
+            section = header.group(1)
+            content = header.group(3).strip(" *`")
+        else:
+            content = line.strip()
+        if not content or section is None:
+            continue
+        bullet = _BULLET_PATTERN.match(content)
+        item = (bullet.group(1) if bullet else content).replace("**", "").strip(" *`")
+        if section == "1":
+            summary = summary or item
+        elif section == "2":
+            findings.append(item)
+        elif section == "3":
+            if severity is None:
+                found = _SEVERITY_PATTERN.search(content)
+                if found:
+                    severity = found.group(1).capitalize()
+                    item = content[found.end():].strip(" *`.:-")
+            if item:
+                justification.append(item)
+        elif section == "4":
+            actions.append(item)
+        elif section == "5":
+            disclaimer = f"{disclaimer} {item}".strip()
+
+    lowered = summary.lower()
+    threat_type = next((kind for phrase, kind in _SUMMARY_THREAT_TYPES if phrase in lowered), None)
+    if threat_type is None:
+        threat_type = "suspicious_activity" if severity in ("Medium", "High", "Critical") else "none"
+    return {
+        "summary": summary or "See report",
+        "threat_type": threat_type,
+        "severity": severity or "Unknown",
+        "severity_justification": " ".join(justification),
+        "iocs": [],
+        "findings": findings,
+        "actions": actions,
+        "disclaimer": disclaimer or DEFAULT_DISCLAIMER,
+    }
+
+
+def parse_structured_report(text: str) -> dict:
+    """Parses a JSON reply (optionally in a code fence) against REPORT_SCHEMA. Raises ReportFormatError."""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.strip("`").strip()
+        if stripped.lower().startswith("json"):
+            stripped = stripped[4:].strip()
+    try:
+        data = json.loads(stripped)
+    except ValueError as e:
+        raise ReportFormatError(f"reply is not valid JSON ({e})") from None
+    return validate_report(data)
+
+
+def parse_report(text: str) -> dict:
+    """
+    Parses a stored or cached report: schema-valid JSON when possible, otherwise the text
+    layout. LLM replies are checked strictly instead (parse_structured_report, check_report).
+    """
+    if text.lstrip().startswith(("{", "```")):
+        try:
+            return parse_structured_report(text)
+        except ReportFormatError as e:
+            print(f"WARNING: Structured report rejected ({e}); parsing it as text")
+    return parse_report_text(text)
+
+
+def check_report(report: dict) -> dict:
+    """Rejects a parsed report without a usable severity, so it is neither shown as final nor cached."""
+    if report["severity"] not in SEVERITIES:
+        raise ReportFormatError("report has no severity assessment")
+    return report
+
+
+def report_iocs(verdicts, limit: int = 200) -> list:
+    """Report IoC entries for threat intel verdicts, flagged ones first, at most limit of them."""
+    rank = {verdict: index for index, verdict in enumerate(IOC_VERDICTS)}
+    ordered = sorted(verdicts, key=lambda v: rank.get(v.verdict, len(rank)))
+    return [{"type": v.ioc_type, "value": v.value, "verdict": v.verdict, "note": v.detail} for v in ordered[:limit]]
+
+
+def render_report_text(report: dict) -> str:
+    """Renders a structured report in the five-section text layout shown to users."""
+    findings = [f"    * {entry['type'].upper()} '{entry['value']}': {entry['verdict'].upper()}"
+                + (f" - {entry['note']}" if entry.get("note") else "") for entry in report["iocs"]]
+    findings += [f"    * {finding}" for finding in report["findings"]]
+    actions = [f"    * {action}" for action in report["actions"]] or ["    * No specific action recommended."]
+    justification = f"\n    {report['severity_justification']}" if report.get("severity_justification") else ""
+    newline = "\n"
+    return (
+        f"1. Threat Summary: {report['summary']}\n\n"
+        f"2. Identified IoCs & Findings:\n{newline.join(findings) or '    * None'}\n\n"
+        f"3. Severity Assessment: {report['severity']}{justification}\n\n"
+        f"4. Recommended Immediate Actions:\n{newline.join(actions)}\n\n"
+        f"5. Disclaimer: {report.get('disclaimer') or DEFAULT_DISCLAIMER}"
+    )
+
+
+def mitigation_for(report: dict) -> list:
+    """Mitigation steps for a report: its recommended actions, or a default for its threat type."""
+    if report["actions"]:
+        return list(report["actions"])
+    return [DEFAULT_MITIGATION.get(report["threat_type"], DEFAULT_MITIGATION["none"])]
@@ -0,0 +1,33 @@
+"""
+Test batch analysis for CyberGuard AI Analyst.
+Sends the green and red scenarios in one /analyze_batch request and checks each streamed result.
+"""
+import json
+import requests
+
+from test_green_scenarios import green_cases
+from test_red_scenarios import red_cases
+
+BASE_URL = "http://localhost:5000/analyze_batch"
+
+def test_batch_cases():
+    cases = [(case, ["informational", "low"]) for case in green_cases] + \
+            [(case, ["high", "critical"]) for case in red_cases]
+    try:
+        resp = requests.post(BASE_URL, json={"texts": [case["text"] for case, _ in cases]}, stream=True)
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            case, expected = cases[data["index"]]
+            print(f"Test: {case['desc']}")
+            if data.get("success") and data.get("severity", "").lower() in expected:
+                print("  ✅ PASSED")
+            else:
+                print(f"  ❌ FAILED: Severity={data.get('severity')} | Message={data.get('message')}")
+            print()
+    except Exception as e:
+        print(f"  ❌ ERROR: {e}\n")
+
+if __name__ == "__main__":
+    test_batch_cases()
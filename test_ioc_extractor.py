@@ -0,0 +1,61 @@
+"""
+Offline test of the IoC extraction engine for CyberGuard AI Analyst (no server needed).
+Covers every IoC type, normalization and deduplication, and occurrence offsets.
+"""
+from ioc_extractor import extract_ioc_matches, extract_iocs_from_text
+
+SHA256 = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+type_cases = [
+    ("URL", "Click http://malicious-link.com/reset?id=1.", "urls", ["http://malicious-link.com/reset?id=1"]),
+    ("Defanged URL", "Seen hxxp://evil.example.ru/payload", "urls", ["hxxp://evil.example.ru/payload"]),
+    ("IPv4", "Failed login from 185.123.45.67 (GB)", "ips", ["185.123.45.67"]),
+    ("IPv6", "Connection from 2001:db8::1 refused", "ips", ["2001:db8::1"]),
+    ("Email", "From: Support@Some-Unusual-Domain.biz", "emails", ["support@some-unusual-domain.biz"]),
+    ("Domain (.com)", "visit example.com today", "domains", ["example.com"]),
+    ("Domain (.zip)", "download from update.zip now", "domains", ["update.zip"]),
+    ("Domain (ccTLD)", "resolved bad-site.ru", "domains", ["bad-site.ru"]),
+    ("Hash", f"SHA256: {SHA256.upper()}", "hashes", [SHA256]),
+    ("CVE", "Exploits cve-2021-44228 in log4j", "cves", ["CVE-2021-44228"]),
+    ("Double-extension filename", "Attachment: Invoice.PDF.exe", "filenames", ["invoice.pdf.exe"]),
+    ("Filename at the end of a sentence", "Please open the attached file invoice.pdf.exe.", "filenames", ["invoice.pdf.exe"]),
+    ("Filename with dots in its name", "Attachments: Invoice.2024.pdf.exe, Q3.report.pdf.exe", "filenames", ["invoice.2024.pdf.exe", "q3.report.pdf.exe"]),
+    ("IPv4-mapped IPv6", "Connection from ::ffff:1.2.3.4 accepted", "ips", ["::ffff:1.2.3.4"]),
+    ("Document name is not a domain", "uploaded report.xlsx and setup.sh", "domains", []),
+    ("User name is not a domain", "User john.smith logged in", "domains", []),
+    ("Timestamp is not an IPv6 address", "2025-05-27 09:00:01 INFO ok", "ips", []),
+    ("Out-of-range octet is not an IP", "version 1.2.3.400", "ips", []),
+]
+
+def test_ioc_types():
+    failures = 0
+    for desc, text, key, expected in type_cases:
+        found = extract_iocs_from_text(text)[key]
+        print(f"Test: {desc}")
+        if found == expected:
+            print("  ✅ PASSED")
+        else:
+            failures += 1
+            print(f"  ❌ FAILED: {key}={found} | Expected={expected}")
+        print()
+    assert failures == 0
+
+def test_dedup_and_normalization():
+    iocs = extract_iocs_from_text("IP 010.000.000.001 and 10.0.0.1; mail A@B.com and a@b.com; HTTP://Example.COM/Path")
+    assert iocs["ips"] == ["10.0.0.1"]
+    assert iocs["emails"] == ["a@b.com"]
+    # Scheme and host are lowercased, the path keeps its case
+    assert iocs["urls"] == ["http://example.com/Path"]
+
+def test_offsets():
+    text = "185.123.45.67 failed, then 185.123.45.67 again from evil.example.ru"
+    matches = extract_ioc_matches(text)
+    assert [(m["type"], m["value"]) for m in matches] == [("ipv4", "185.123.45.67"), ("domain", "evil.example.ru")]
+    assert matches[0]["offsets"] == [0, text.index("185.123.45.67", 1)]
+    assert matches[1]["offsets"] == [text.index("evil.example.ru")]
+
+if __name__ == "__main__":
+    test_ioc_types()
+    test_dedup_and_normalization()
+    test_offsets()
+    print("IoC extractor checks passed.")
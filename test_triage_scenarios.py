@@ -0,0 +1,75 @@
+"""
+Offline test of local pre-triage for CyberGuard AI Analyst (no server or LLM needed).
+Green scenarios must never be triaged as malicious, red scenarios never cleared as benign,
+and adversarial texts without IoCs must not be cleared without reaching the LLM.
+"""
+from cyber_agent_core import run_agent_tools
+from triage import triage_input
+from test_green_scenarios import green_cases
+from test_red_scenarios import red_cases
+
+adversarial_cases = [
+    {
+        "desc": "Credential request without a link",
+        "text": "Hi, IT here. Please reply to this email with your username and password so we can migrate your mailbox."
+    },
+    {
+        "desc": "CEO gift card request",
+        "text": "From: CEO\nI'm in a meeting and need you to buy five store cards for a client. Send me the card codes as soon as possible."
+    },
+    {
+        "desc": "Macro-enabled invoice lure",
+        "text": "Please open the attached invoice and enable macros to view the full document."
+    },
+    {
+        "desc": "Encoded PowerShell command",
+        "text": "Process created: powershell -enc SQBFAFgAIAAoAE4AZQB3AC0ATwBiAGoAZQBjAHQAIABOAGUAdAAuAFcAZQBiAEMAbABpAGUAbgB0ACkA"
+    },
+    {
+        "desc": "SSH brute force from an internal address",
+        "text": "500 failed SSH login attempts for root from 10.0.0.5"
+    },
+    {
+        "desc": "Credential dumping and lateral movement between internal hosts",
+        "text": "mimikatz.exe dumped lsass on host 192.168.1.20; outbound connection to 10.0.0.7:4444"
+    },
+    {
+        "desc": "DNS beaconing from an internal host",
+        "text": "DNS beaconing detected: host 172.16.4.2 queried random subdomains every 60 seconds for 6 hours"
+    },
+    {
+        "desc": "Plain text with no evidence either way",
+        "text": "Can you take a look at this when you get a chance?"
+    },
+]
+
+def _decide(text):
+    iocs, verdicts, _ = run_agent_tools(text)
+    return triage_input(text, iocs, verdicts, record=False)
+
+def _check(cases, rejected):
+    failures = 0
+    for case in cases:
+        result = _decide(case["text"])
+        print(f"Test: {case['desc']}")
+        if result.decision != rejected:
+            print(f"  ✅ PASSED ({result.decision}, {result.severity})")
+        else:
+            failures += 1
+            print(f"  ❌ FAILED: triaged {result.decision} | Reasons={result.reasons}")
+        print()
+    return failures
+
+def test_green_cases_not_triaged_malicious():
+    assert _check(green_cases, "malicious") == 0
+
+def test_red_cases_not_cleared():
+    assert _check(red_cases, "benign") == 0
+
+def test_adversarial_cases_not_cleared():
+    assert _check(adversarial_cases, "benign") == 0
+
+if __name__ == "__main__":
+    test_green_cases_not_triaged_malicious()
+    test_red_cases_not_cleared()
+    test_adversarial_cases_not_cleared()
@@ -0,0 +1,228 @@
+"""
+Pluggable threat intelligence lookup layer.
+
+A ThreatIntelProvider answers reputation lookups for IoCs. ThreatIntelService fans the
+IoCs of one input out to every provider concurrently, sends them in batches to
+providers that support it, and caches each verdict per IoC with a TTL.
+All verdicts are deterministic, so analysis results are reproducible and cacheable.
+"""
+import csv
+import ipaddress
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from caching import TTLCache
+from ioc_extractor import IOC_LOOKUP_TYPES
+from reputation_index import ReputationIndex
+
+# Verdicts ordered from least to most severe. When providers disagree, the most severe wins.
+VERDICT_SEVERITY = {"unknown": 0, "clean": 1, "internal": 2, "suspicious": 3, "malicious": 4}
+
+Verdict = namedtuple("Verdict", ["ioc_type", "value", "verdict", "detail", "source"])
+
+_DEFAULT_DETAILS = {
+    "malicious": "MALICIOUS. Listed in threat intelligence feed.",
+    "suspicious": "SUSPICIOUS. Listed in threat intelligence feed.",
+    "internal": "INTERNAL/PRIVATE IP. Cannot be externally looked up.",
+    "clean": "Known good indicator.",
+    "unknown": "No threat data found in simulated database.",
+}
+
+_TYPE_LABELS = {
+    "url": "URL",
+    "ip": "IP",
+    "email": "Email",
+    "domain": "Domain",
+    "hash": "Hash",
+    "cve": "CVE",
+    "filename": "File",
+}
+
+DEFAULT_FEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "threat_intel_feed.csv")
+
+
+def type_label(ioc_type: str) -> str:
+    """Display label of a lookup type, e.g. 'ip' -> 'IP'."""
+    return _TYPE_LABELS.get(ioc_type, ioc_type)
+
+
+def format_verdict(verdict: Verdict) -> str:
+    """Renders a verdict as the tool output line shown to the LLM."""
+    return f"Simulated Threat Intel for {type_label(verdict.ioc_type)} '{verdict.value}': {verdict.detail}"
+
+
+class ThreatIntelProvider:
+    """
+    Base class for reputation providers. Subclasses implement lookup(), and providers
+    backed by an API with bulk endpoints also override lookup_batch() and set supports_batch.
+    A lookup returns a Verdict, or None when the provider has no data for the IoC.
+    """
+    name = "provider"
+    supports_batch = False
+    max_batch_size = 100
+
+    def lookup(self, ioc_type: str, value: str):
+        raise NotImplementedError
+
+    def lookup_batch(self, items: list) -> dict:
+        """Looks up a list of (ioc_type, value) pairs. Returns {(ioc_type, value): Verdict or None}."""
+        return {item: self.lookup(*item) for item in items}
+
+
+class LocalFeedProvider(ThreatIntelProvider):
+    """
+    Local, file-backed stand-in for a remote reputation service such as VirusTotal.
+    Exact indicators come from a CSV (type,value,verdict,detail) or JSON list of the same fields;
+    anything not in the feed falls back to fixed pattern rules.
+    """
+    name = "local_feed"
+    supports_batch = True
+
+    URL_MALICIOUS_WORDS = ("malicious", "scam", "phish")
+    SCAM_SENDER_WORDS = ("nigerianprince", "urgentdelivery", "amazonsupport")
+
+    def __init__(self, path: str = None):
+        self.path = path or DEFAULT_FEED_PATH
+        self.entries = {}
+        if os.path.exists(self.path):
+            self._load(self.path)
+
+    def _load(self, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = json.load(f) if path.endswith(".json") else csv.DictReader(row for row in f if not row.startswith("#"))
+            for row in rows:
+                ioc_type = row["type"].strip().lower()
+                value = row["value"].strip().lower()
+                verdict = row.get("verdict", "malicious").strip().lower()
+                detail = (row.get("detail") or "").strip() or _DEFAULT_DETAILS[verdict]
+                self.entries[(ioc_type, value)] = Verdict(ioc_type, value, verdict, detail, self.name)
+
+    def lookup(self, ioc_type: str, value: str):
+        entry = self.entries.get((ioc_type, value.lower()))
+        if entry is not None:
+            return entry._replace(value=value)
+        return self._rule_lookup(ioc_type, value)
+
+    def _rule_lookup(self, ioc_type, value):
+        lowered = value.lower()
+        if ioc_type in ("url", "domain"):
+            if any(word in lowered for word in self.URL_MALICIOUS_WORDS):
+                return Verdict(ioc_type, value, "malicious", f"Known MALICIOUS {_TYPE_LABELS[ioc_type]}, categorized as phishing/malware distribution.", self.name)
+            if "update" in lowered:
+                return Verdict(ioc_type, value, "suspicious", "SUSPICIOUS. Domain patterns suggest potential phishing or fake updates.", self.name)
+        elif ioc_type == "ip":
+            try:
+                address = ipaddress.ip_address(value)
+            except ValueError:
+                return None
+            if address.is_private or address.is_loopback or address.is_link_local:
+                return Verdict(ioc_type, value, "internal", _DEFAULT_DETAILS["internal"], self.name)
+        elif ioc_type == "email":
+            if any(word in lowered for word in self.SCAM_SENDER_WORDS):
+                return Verdict(ioc_type, value, "malicious", "KNOWN SPAM/SCAM SENDER.", self.name)
+        elif ioc_type == "filename":
+            return Verdict(ioc_type, value, "malicious", "MALICIOUS PATTERN. Document name with an executable double extension, a classic malware delivery tactic.", self.name)
+        return None
+
+
+class ReputationIndexProvider(ThreatIntelProvider):
+    """Matches IoCs against bulk-loaded local blocklists (IPs, CIDR ranges, domains, URL prefixes)."""
+    name = "reputation_index"
+    supports_batch = True
+    max_batch_size = 1000
+
+    def __init__(self, index: ReputationIndex):
+        self.index = index
+
+    def lookup(self, ioc_type: str, value: str):
+        match = self.index.lookup(ioc_type, value)
+        if match is None:
+            return None
+        return Verdict(ioc_type, value, "malicious", f"MALICIOUS. Matches {match.kind} '{match.indicator}' in blocklist '{match.feed}'.", self.name)
+
+
+class ThreatIntelService:
+    """Resolves IoCs against all providers concurrently, with per-IoC verdict caching."""
+
+    def __init__(self, providers: list, cache_ttl: float = 3600, cache_size: int = 10000, max_workers: int = 16):
+        self.providers = list(providers)
+        self.cache = TTLCache(max_entries=cache_size, ttl=cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="threat-intel")
+
+    def lookup(self, ioc_type: str, value: str) -> Verdict:
+        return self.resolve_items([(ioc_type, value)])[(ioc_type, value)]
+
+    def resolve(self, iocs: dict) -> dict:
+        """
+        Resolves the output of extract_iocs_from_text(). Returns {(lookup_type, value): Verdict}
+        in extraction order.
+        """
+        items = [(IOC_LOOKUP_TYPES[key], value) for key, values in iocs.items() for value in values]
+        return self.resolve_items(items)
+
+    def resolve_items(self, items: list) -> dict:
+        items = list(dict.fromkeys(items))
+        verdicts = {}
+        misses = []
+        for item in items:
+            cached = self.cache.get(item)
+            if cached is None:
+                misses.append(item)
+            else:
+                verdicts[item] = cached
+
+        if misses:
+            # One task per provider batch (or per IoC for non-batching providers), all in flight at once
+            futures = []
+            for provider in self.providers:
+                if provider.supports_batch:
+                    for start in range(0, len(misses), provider.max_batch_size):
+                        batch = misses[start:start + provider.max_batch_size]
+                        futures.append((self._executor.submit(provider.lookup_batch, batch), batch))
+                else:
+                    for item in misses:
+                        futures.append((self._executor.submit(lambda p, i: {i: p.lookup(*i)}, provider, item), [item]))
+
+            found = {}
+            # IoCs that a provider failed to answer for; their verdicts are returned but not cached,
+            # so a transient provider failure cannot hide a malicious verdict for the cache TTL
+            unanswered = set()
+            for future, batch in futures:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"WARNING: Threat intel provider lookup failed: {e}")
+                    unanswered.update(batch)
+                    continue
+                for item, verdict in results.items():
+                    if verdict is not None and (item not in found or VERDICT_SEVERITY[verdict.verdict] > VERDICT_SEVERITY[found[item].verdict]):
+                        found[item] = verdict
+
+            for item in misses:
+                verdict = found.get(item) or Verdict(item[0], item[1], "unknown", _DEFAULT_DETAILS["unknown"], "none")
+                if item not in unanswered:
+                    self.cache.set(item, verdict)
+                verdicts[item] = verdict
+
+        return {item: verdicts[item] for item in items}
+
+
+def threat_intel_from_env() -> ThreatIntelService:
+    """
+    Builds the lookup service from THREAT_INTEL_FEED, THREAT_INTEL_CACHE_TTL and THREAT_INTEL_WORKERS.
+    Blocklists listed in REPUTATION_FEEDS (separated by commas) are loaded into a reputation index
+    that is polled for changes every REPUTATION_RELOAD_INTERVAL seconds.
+    """
+    providers = [LocalFeedProvider(os.getenv("THREAT_INTEL_FEED") or None)]
+    feed_paths = [path.strip() for path in os.getenv("REPUTATION_FEEDS", "").split(",") if path.strip()]
+    if feed_paths:
+        index = ReputationIndex(feed_paths, max_entries=int(os.getenv("REPUTATION_MAX_ENTRIES", 10000000)))
+        index.start_auto_reload(float(os.getenv("REPUTATION_RELOAD_INTERVAL", 300)))
+        providers.append(ReputationIndexProvider(index))
+    return ThreatIntelService(
+        providers=providers,
+        cache_ttl=float(os.getenv("THREAT_INTEL_CACHE_TTL", 3600)),
+        max_workers=int(os.getenv("THREAT_INTEL_WORKERS", 16)),
+    )
@@ -0,0 +1,191 @@
+"""
+Deterministic local pre-triage.
+
+Scores an input from the IoC extraction and threat lookup results plus the keyword and
+double-extension heuristics that the analyst prompt describes. Inputs that are clearly
+benign or clearly malicious get a templated report without an LLM call; everything
+else is left to the LLM. The absence of threat signals is not enough to clear an input:
+a benign decision needs positive evidence, either external indicators that all resolve
+to known-good values, or a known routine notification. Internal addresses are neutral.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from report_schema import report_iocs
+
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() not in ("0", "false", "no")
+TRIAGE_CONFIDENCE_THRESHOLD = float(os.getenv("TRIAGE_CONFIDENCE_THRESHOLD", 0.85))
+
+TriageResult = namedtuple("TriageResult", ["decision", "severity", "confidence", "threat_type", "reasons"])
+
+# (weight, threat type, description, phrases). Each group counts once per input.
+_KEYWORD_GROUPS = (
+    (0.35, "phishing", "credential phishing language", (
+        "password reset", "reset your password", "account compromised", "account has been compromised",
+        "verify your account", "account verification", "verify your details", "confirm your identity",
+        "account will be locked", "avoid suspension", "account suspension", "unusual activity on your account",
+        "username and password", "with your password", "send your password", "your credentials", "login credentials",
+    )),
+    (0.15, "phishing", "urgency pressure", (
+        "urgent", "immediately", "within 24 hours", "act now", "final notice",
+    )),
+    (0.6, "ransomware", "ransom demand", (
+        "files have been encrypted", "files are encrypted", "decryption key", "ransom", "bitcoin", " btc",
+    )),
+    (0.3, "fraud", "payment request", (
+        "transfer $", "wire transfer", "gift card", "store card", "card codes", "payment to the following",
+    )),
+    (0.4, "malware", "document macro lure", (
+        "enable macros", "enable content", "enable editing",
+    )),
+    (0.5, "malware", "encoded or fileless command", (
+        "powershell -enc", "powershell.exe -enc", "-encodedcommand", "frombase64string", "invoke-expression",
+        "iex(", "downloadstring(", "cmd.exe /c",
+    )),
+)
+
+# Routine notifications that count as positive evidence of a benign input, when nothing else scores
+_BENIGN_TEMPLATES = (
+    "password was changed successfully", "backup completed successfully", "thank you for subscribing",
+    "this is an automated reminder", "just a reminder about our",
+)
+
+# Weight of a threat intel verdict by lookup type. Double-extension filenames are decisive on their own.
+_VERDICT_WEIGHTS = {
+    "malicious": {"filename": 0.9, "default": 0.6},
+    "suspicious": {"default": 0.3},
+}
+
+_THREAT_TITLES = {
+    "phishing": "Likely Phishing Attempt",
+    "ransomware": "Likely Ransomware Incident",
+    "malware": "Potential Malware Distribution",
+    "fraud": "Likely Payment Fraud / Social Engineering",
+    "malicious_infrastructure": "Contact With Known Malicious Infrastructure",
+}
+
+_stats_lock = threading.Lock()
+triage_stats = {"total": 0, "benign": 0, "malicious": 0, "uncertain": 0, "llm_calls_avoided": 0}
+
+
+def triage_input(input_text: str, iocs: dict, verdicts: dict, threshold: float = None, record: bool = True) -> TriageResult:
+    """
+    Scores one input. verdicts is the ThreatIntelService.resolve() result for iocs.
+    Returns a decision of 'benign', 'malicious' or 'uncertain' (send to the LLM). Uncertain
+    results carry a provisional severity, used when the LLM is unavailable.
+    Pass record=False to leave the decision counters untouched.
+    """
+    result = _score(input_text, iocs, verdicts, TRIAGE_CONFIDENCE_THRESHOLD if threshold is None else threshold)
+    return _record(result) if record else result
+
+
+def _score(input_text, iocs, verdicts, threshold):
+    lowered = input_text.lower()
+    score = 0.0
+    reasons = []
+    threat_scores = {}
+
+    for verdict in verdicts.values():
+        weights = _VERDICT_WEIGHTS.get(verdict.verdict)
+        if weights:
+            weight = weights.get(verdict.ioc_type, weights["default"])
+            score += weight
+            threat_type = "malware" if verdict.ioc_type in ("filename", "hash") else "malicious_infrastructure"
+            threat_scores[threat_type] = threat_scores.get(threat_type, 0) + weight
+            reasons.append(f"{verdict.ioc_type} '{verdict.value}' flagged {verdict.verdict.upper()} by threat intel")
+
+    for weight, threat_type, description, phrases in _KEYWORD_GROUPS:
+        matched = next((phrase for phrase in phrases if phrase in lowered), None)
+        if matched:
+            score += weight
+            threat_scores[threat_type] = threat_scores.get(threat_type, 0) + weight
+            reasons.append(f"{description} (\"{matched.strip()}\")")
+
+    # Credential-phishing language next to an external link is the classic phishing combination
+    if iocs.get("urls") and any(reason.startswith("credential phishing") for reason in reasons):
+        score += 0.3
+        threat_scores["phishing"] = threat_scores.get("phishing", 0) + 0.3
+        reasons.append("link included alongside credential phishing language")
+
+    # External indicators with no threat data keep a clean-looking input from being auto-cleared
+    unknown_external = [v for v in verdicts.values() if v.verdict == "unknown"]
+
+    if score > 0:
+        confidence = min(score, 1.0)
+        if confidence >= threshold:
+            severity = "Critical" if score >= 1.2 else "High"
+            threat_type = max(threat_scores, key=threat_scores.get)
+            return TriageResult("malicious", severity, round(confidence, 2), threat_type, reasons)
+        return TriageResult("uncertain", "Medium", round(confidence, 2), None, reasons)
+
+    if unknown_external:
+        confidence = max(0.0, 0.75 - 0.25 * (len(unknown_external) - 1))
+        reasons = [f"{len(unknown_external)} external indicator(s) with no threat data"]
+    elif any(v.verdict == "clean" for v in verdicts.values()):
+        # Every external indicator is known-good. Internal addresses are neutral: they can
+        # neither be looked up nor vouch for an alert (brute force, lateral movement, beaconing).
+        confidence = 1.0
+        reasons = ["all external IoCs resolved to known-good values", "no social engineering or extortion language"]
+    else:
+        template = next((phrase for phrase in _BENIGN_TEMPLATES if phrase in lowered), None)
+        confidence = 0.9 if template else 0.5
+        reasons = [f"routine notification (\"{template}\")" if template else "no known-good indicators or routine content to confirm it is benign",
+                   "no social engineering or extortion language"]
+    if confidence >= threshold:
+        return TriageResult("benign", "Informational" if not verdicts else "Low", round(confidence, 2), None, reasons)
+    return TriageResult("uncertain", "Low", round(confidence, 2), None, reasons)
+
+
+def _record(result: TriageResult) -> TriageResult:
+    with _stats_lock:
+        triage_stats["total"] += 1
+        triage_stats[result.decision] += 1
+        if result.decision != "uncertain":
+            triage_stats["llm_calls_avoided"] += 1
+    return result
+
+
+def get_triage_stats() -> dict:
+    with _stats_lock:
+        return dict(triage_stats)
+
+
+def triage_report(result: TriageResult, verdicts: dict, fallback_reason: str = None) -> dict:
+    """
+    Structured report (see report_schema) for a triage result, in the same shape the LLM is
+    asked to produce. With fallback_reason, it stands in for an LLM report that could not be generated.
+    """
+    if fallback_reason and result.decision == "uncertain":
+        summary = "Possible Threat, Pending Review" if result.severity == "Medium" else "No Confirmed Threat, Pending Review"
+        actions = [
+            "Treat the indicators above with caution until the analysis is repeated.",
+            "Re-submit this input once the AI service is available, or escalate to the security team.",
+        ]
+        justification = f"AI analysis unavailable ({fallback_reason}); provisional severity from local triage."
+        threat_type = "suspicious_activity" if result.severity == "Medium" else "none"
+    elif result.decision == "benign":
+        summary = "No Immediate Threat Detected"
+        actions = ["No action required. Continue routine monitoring."]
+        justification = "Local triage found no flagged indicators and no threat language."
+        threat_type = "none"
+    else:
+        summary = _THREAT_TITLES.get(result.threat_type, "Likely Malicious Activity")
+        actions = [
+            "Do not click links, open attachments or reply to this message.",
+            "Block the flagged indicators at the email gateway, proxy and firewall.",
+            "Report the incident to the security team and check for other recipients or affected hosts.",
+        ]
+        justification = "Local triage matched high-confidence threat indicators."
+        threat_type = result.threat_type or "suspicious_activity"
+    return {
+        "summary": summary,
+        "threat_type": threat_type,
+        "severity": result.severity,
+        "severity_justification": f"{justification} (confidence {result.confidence:.2f})",
+        "iocs": report_iocs(verdicts.values()),
+        "findings": list(result.reasons),
+        "actions": actions,
+        "disclaimer": "This is an automated rule-based initial analysis generated without the AI model. "
+                      "A full human security assessment is required.",
+    }
@@ -0,0 +1,90 @@
+"""
+Settings and helpers shared by the Flask app (app.py) and the ASGI app (asgi_app.py):
+input limits, the history store, analysis result building and chatbot answers.
+Neither web framework is imported here, so each app loads only its own.
+"""
+import json
+import os
+
+from report_schema import mitigation_for, render_report_text
+from history_store import history_store_from_env, parse_history_time
+from metrics import timed
+
+# Analysis history lives in SQLite so it survives restarts and is shared by all workers
+history_store = history_store_from_env()
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Input size limits. Log analysis ('mode': 'log') accepts much larger pastes since
+# IoC extraction is a single linear scan.
+MAX_INPUT_CHARS = int(os.getenv('MAX_INPUT_CHARS', 5000))
+MAX_LOG_INPUT_CHARS = int(os.getenv('MAX_LOG_INPUT_CHARS', 1000000))
+# Whole log files go to /analyze_log, which reads them incrementally in chunks
+LOG_MAX_UPLOAD_BYTES = int(os.getenv('LOG_MAX_UPLOAD_BYTES', 500 * 1024 * 1024))
+
+
+def build_analysis_result(input_text, analysis, report_text=None):
+    """
+    Result for the API and history from a structured report. Severity, threat type and
+    mitigation are read from its fields; report_text is the text already shown to the
+    user (a streamed report), otherwise the report is rendered.
+    """
+    with timed('postprocess'):
+        return {
+            'input': input_text,
+            'report': report_text if report_text is not None else render_report_text(analysis),
+            'mitigation': mitigation_for(analysis),
+            'severity': analysis['severity'],
+            'threat_type': analysis['threat_type'],
+            'analysis': analysis,
+        }
+
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event. Data is JSON-encoded so multi-line report text stays in one event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def history_query_from_args(args):
+    """Converts /history query string arguments into HistoryStore.query() keyword arguments."""
+    cursor = args.get('cursor')
+    return {
+        'limit': max(1, min(int(args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)),
+        'cursor': int(cursor) if cursor else None,
+        'severity': args.get('severity'),
+        'threat_type': args.get('threat_type'),
+        'ioc': args.get('ioc'),
+        'verdict': args.get('verdict'),
+        'since': parse_history_time(args.get('since')),
+        'until': parse_history_time(args.get('until')),
+    }
+
+
+def chatbot_reply(message):
+    """Keyword-based answer for a lowercased chatbot message."""
+    # Simple keyword-based responses
+    if "ai" in message or "artificial intelligence" in message:
+        answer = "AI (Artificial Intelligence) refers to computer systems that can perform tasks that typically require human intelligence, such as learning, reasoning, and problem-solving."
+    elif "risk" in message:
+        answer = "A risk is the potential for loss or damage when a threat exploits a vulnerability."
+    elif "threat" in message:
+        answer = "A threat is any circumstance or event with the potential to adversely impact organizational operations, assets, or individuals."
+    elif "phishing" in message:
+        answer = "Phishing is a cyber attack where attackers impersonate legitimate organizations via email, text, or other means to steal sensitive information."
+    elif "malware" in message:
+        answer = "Malware is malicious software designed to disrupt, damage, or gain unauthorized access to computer systems."
+    elif "ransomware" in message:
+        answer = "Ransomware is a type of malware that encrypts your files and demands payment for the decryption key."
+    elif "mitigation" in message or "prevent" in message:
+        answer = "Mitigation steps include keeping software updated, using strong passwords, enabling multi-factor authentication, and educating users about threats."
+    elif "history" in message:
+        answer = "You can view your analysis history by clicking the 'View Analysis History' button below the main panel."
+    elif "how to use" in message or "help" in message:
+        answer = "Paste suspicious text (like emails, logs, or URLs) in the input box and click 'Analyze Threat' to get an AI-powered analysis."
+    elif "cybersecurity" in message:
+        answer = "Cybersecurity is the practice of protecting systems, networks, and programs from digital attacks."
+    elif "ioc" in message or "indicator of compromise" in message:
+        answer = "An Indicator of Compromise (IOC) is evidence that a system has been breached, such as unusual network traffic, file changes, or log entries."
+    else:
+        answer = "I'm your CyberGuard Assistant. Ask me about AI, threats, phishing, malware, risk, mitigation, or how to use this tool!"
+    return answer